@@ -7,7 +7,7 @@ from distributed.utils import sleep, time
 from joblib import Parallel, delayed
 
 
-def simulate_user(puid, url="http://127.0.0.1:8000", num_clicks=50):
+def simulate_user(puid, url="http://127.0.0.1:8421", num_clicks=50):
     # Reaction times from [1, Figure 6] for "spatial configuration" task with 3
     # items (it closely mirrors the triplets task)
     #
@@ -20,7 +20,7 @@ def simulate_user(puid, url="http://127.0.0.1:8000", num_clicks=50):
     _start = time()
     for k in range(num_clicks):
         print(puid, k)
-        q = requests.get(url + "/get_query")
+        q = requests.get(url + "/query")
         network_latency = time() - _start
         query = q.json()
         winner = random.choice([query["left"], query["right"]])
@@ -35,17 +35,21 @@ def simulate_user(puid, url="http://127.0.0.1:8000", num_clicks=50):
             **query,
         }
         _start = time()
-        requests.post(url + "/process_answer", json=answer)
+        requests.post(url + "/answer", json=answer)
     return puid
 
 
 if __name__ == "__main__":
-    url = "http://127.0.0.1:8000"
-    url = "http://ec2-44-234-59-0.us-west-2.compute.amazonaws.com:8000"
+    url = "http://127.0.0.1:8421"
     num_clicks = 50
     num_users = 100
 
+    start = time()
     results = Parallel(n_jobs=num_users, backend="threading")(
         delayed(simulate_user)(seed, url=url, num_clicks=num_clicks)
         for seed in range(num_users)
     )
+    duration = time() - start
+    num_answers = num_clicks * num_users
+    print(f"{num_answers} answers in {duration:0.1f}s")
+    print(f"throughput: {num_answers / duration:0.1f} answers/s")
@@ -3,8 +3,8 @@
 # Currently so don't have to rebuild docker machines; see
 # https://github.com/dask/dask-docker/pull/108
 
-# TODO: _NPROCESSORS_ONLN==1 for github actions. Leads to index error on
-# backend, not enough workers.
+# _NPROCESSORS_ONLN==1 for github actions. With fewer than 3 Dask workers,
+# the samplers run their tasks in a local thread pool (execution="auto").
 
 
 export NUM_PROCS=$(getconf _NPROCESSORS_ONLN)
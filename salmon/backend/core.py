@@ -15,7 +15,7 @@ from rejson import Client, Path
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from salmon.frontend.utils import ServerException
-from salmon.triplets import samplers
+from salmon.triplets import passive, samplers
 from salmon.utils import flush_logger, get_logger
 
 DEBUG = os.environ.get("SALMON_DEBUG", 0)
@@ -99,7 +99,7 @@ async def init(ident: str, background_tasks: BackgroundTasks) -> bool:
     config = rj.jsonget("exp_config")
 
     try:
-        if f"state-{ident}" in rj.keys():
+        if rj.exists(f"state-{ident}"):
             logger.warning(f"Initializing alg from key 'state-{ident}'")
             # See https://github.com/andymccurdy/redis-py/issues/1006
             rj2 = Client(host="redis", port=6379, decode_responses=False)
@@ -124,8 +124,16 @@ async def init(ident: str, background_tasks: BackgroundTasks) -> bool:
         flush_logger(logger)
         raise ExpParsingError(status_code=500, detail=msg)
 
+    alg.query_encoding = config["sampling"].get("query_encoding", "str")
     SAMPLERS[ident] = alg
 
+    # Let the frontend generate queries for passive samplers
+    if config["sampling"].get("passive_frontend", True) and hasattr(
+        alg, "passive_spec"
+    ):
+        spec = {"seed": random.randrange(2 ** 31), **alg.passive_spec()}
+        passive.store_spec(rj, ident, spec)
+
     dask_client = DaskClient("127.0.0.2:8786")
     logger.info("Before adding init task")
     background_tasks.add_task(alg.run, dask_client)
@@ -159,6 +167,35 @@ def get_query(ident: str, puid: str=""):
         return {"sampler": ident, "score": score, **q}
 
 
+@app.get("/queries/{ident}")
+def get_queries(ident: str, n: int = 1, puid: str = ""):
+    """
+    Get up to ``n`` queries from the sampler's ``get_query`` method (if it
+    has one). Fewer queries are returned if ``get_query`` runs out of
+    queries.
+    """
+    global SAMPLERS
+    alg = SAMPLERS[ident]
+    if not hasattr(alg, "get_query"):
+        raise HTTPException(status_code=404)
+    kwargs = dict() if not puid else dict(puid=puid)
+    queries = []
+    try:
+        for _ in range(n):
+            q, score = alg.get_query(**kwargs)
+            if q is None:
+                break
+            queries.append({"sampler": ident, "score": score, **q})
+    except Exception as e:
+        logger.exception(e)
+        flush_logger(logger)
+        raise HTTPException(status_code=500, detail=str(e))
+    if not len(queries):
+        flush_logger(logger)
+        raise HTTPException(status_code=404)
+    return queries
+
+
 def _fmt_params(k, v):
     if isinstance(v, (str, int, float, bool, list)):
         return v
@@ -175,8 +212,7 @@ async def get_model(sampler: str):
             f"Can't find model for sampler='{sampler}'. "
             f"Valid choices for sampler are {samplers}"
         )
-    if f"model-{sampler}" not in rj.keys():
-        logger.warning("rj.keys() = %s", rj.keys())
+    if not rj.exists(f"model-{sampler}"):
         flush_logger(logger)
         raise ServerException(f"Model has not been created for sampler='{sampler}'")
     rj2 = Client(host="redis", port=6379, decode_responses=False)
@@ -195,12 +231,8 @@ async def get_timings(sampler: str):
         )
         logger.warning(msg)
         raise ServerException(msg)
-    keys = list(sorted(rj.keys()))
-    if f"alg-perf-{sampler}" not in keys:
-        logger.warning("rj.keys() = %s", keys)
-        msg = (
-            f"Performance data has not been created for sampler='{sampler}'. Database has keys {keys}"
-        )
+    if not rj.exists(f"alg-perf-{sampler}"):
+        msg = f"Performance data has not been created for sampler='{sampler}'."
         logger.warning(msg)
         raise ServerException(msg)
     return rj.jsonget(f"alg-perf-{sampler}")
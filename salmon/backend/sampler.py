@@ -1,13 +1,16 @@
 import itertools
+import json
 import random
+import threading
+from copy import deepcopy
 from gc import collect as garbage_collect
 from pprint import pprint
-from time import sleep, time
-from typing import Any, Dict, List, Optional, Tuple, TypeVar
+from time import time
+from typing import Any, Dict, List, Optional, Tuple, TypeVar, Union
 
 import numpy as np
 
-from salmon.utils import flush_logger, get_logger
+from salmon.utils import EVENT_CHANNEL, flush_logger, get_logger
 
 logger = get_logger(__name__)
 
@@ -15,6 +18,324 @@ Query = TypeVar("Query")
 Answer = TypeVar("Answer")
 
 
+# KEYS = [shadow, live]. RENAME the shadow pool over the live pool, but only
+# if the shadow pool has queries (RENAME fails if it doesn't exist, and
+# deleting the live pool would mean serving random queries).
+_SWAP_QUERIES = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("RENAME", KEYS[1], KEYS[2])
+end
+return redis.call("ZCARD", KEYS[2])
+"""
+
+
+#: The consumer group that reads answers from the ``alg-{ident}-answers``
+#: streams.
+ANSWER_GROUP = "samplers"
+
+# The answer streams with a consumer group (created in this process)
+_ANSWER_GROUPS = set()
+
+
+class _Events:
+    """
+    Listen for the events the frontend publishes on ``EVENT_CHANNEL`` (so
+    the run loop doesn't have to poll the database).
+    """
+
+    def __init__(self, rj: "RedisClient", ident: str):
+        self.ident = ident
+        self.pubsub = rj.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(EVENT_CHANNEL)
+        self.reset = False
+        self.pending = False  # answers received but not read yet
+
+    def wait(self, timeout: float = 0) -> bool:
+        """
+        Handle every event received, waiting up to ``timeout`` seconds for
+        the first one. Returns True if there was an event for this sampler.
+        """
+        deadline = time() + timeout
+        received = False
+        while True:
+            message = self.pubsub.get_message(timeout=max(deadline - time(), 0))
+            if message is None:
+                return received
+            data = message["data"]
+            if isinstance(data, bytes):
+                data = data.decode()
+            if data == "reset":
+                self.reset = received = True
+            elif data == f"answers-{self.ident}":
+                self.pending = received = True
+            if received:
+                deadline = 0  # don't wait for more events
+
+    def close(self):
+        self.pubsub.close()
+
+
+def _process_answers(sampler: "Sampler", answers: List[Answer]):
+    """
+    Process answers on a sampler replica (in place), and return what changed.
+    """
+    new_sampler, update = sampler.process_answers(answers)
+    if new_sampler is not sampler:
+        sampler.__dict__.update(new_sampler.__dict__)
+    return update, sampler.get_delta(answers)
+
+
+def _gather(sampler: "Sampler", f_post, f_model, f_search):
+    """
+    Wait for the tasks of one iteration of :meth:`Sampler.run`.
+
+    The model's changes are applied to ``sampler`` as soon as they're ready,
+    so they're kept if posting or searching fails (and the replicas are
+    restarted from ``sampler``).
+    """
+    update, delta = f_model.result()
+    _s = time()
+    sampler.apply_delta(delta)
+    time_update = time() - _s
+    posted = f_post.result()
+    queries, scores, search_meta = f_search.result()
+    return posted, update, delta, time_update, (queries, scores, search_meta)
+
+
+def _get_queries(sampler: "Sampler", delta: Optional[Dict[str, Any]], **kwargs):
+    """
+    Bring a sampler replica up to date with ``delta``, then get queries.
+    """
+    if delta is not None:
+        sampler.apply_delta(delta)
+    return sampler.get_queries(**kwargs)
+
+
+class SamplerActor:
+    """
+    Hold a sampler replica in a Dask worker's memory.
+
+    This is used as a Dask actor (``client.submit(SamplerActor, sampler,
+    actor=True)``) when ``Sampler.execution == "actors"``.
+    """
+
+    def __init__(self, sampler: "Sampler"):
+        self.sampler = sampler
+
+    def process_answers(self, answers: List[Answer], done=None):
+        try:
+            return _process_answers(self.sampler, answers)
+        finally:
+            if done is not None:
+                done.set()
+
+    def get_queries(self, delta: Optional[Dict[str, Any]], **kwargs):
+        return _get_queries(self.sampler, delta, **kwargs)
+
+
+class _FuturesExecution:
+    """
+    Run the sampler replicas as Dask futures pinned to workers.
+
+    The replicas are modified in place, so they must stay on their workers
+    (and have unique keys; ``hash=False``).
+    """
+
+    def __init__(self, sampler: "Sampler", client: "DaskClient"):
+        self.sampler = sampler
+        self.client = client
+        workers = list(client.has_what())
+        random.shuffle(workers)
+        self.post_worker, self.model_worker, self.search_worker = workers[:3]
+        self.handle = client.scatter(sampler.handle(), workers=[self.post_worker])
+        self.model = self.search = None
+
+    def start(self) -> bool:
+        """
+        Send the sampler to the workers (if needed). Returns True if the
+        replicas were (re)started.
+        """
+        if self.model is not None and self.search is not None:
+            return False
+        self.model = self.client.scatter(
+            self.sampler, workers=[self.model_worker], hash=False
+        )
+        self.search = self.client.scatter(
+            self.sampler, workers=[self.search_worker], hash=False
+        )
+        return True
+
+    def stop(self):
+        """
+        Forget the replicas (e.g., because they might be partially updated).
+        """
+        self.model = self.search = None
+
+    def close(self):
+        """
+        Release any resources (after :meth:`Sampler.run` is done).
+        """
+        self.stop()
+
+    def event(self):
+        import dask.distributed as distributed
+
+        return distributed.Event(name="pa_finished")
+
+    def _submit(self, fn, *args, worker, allow_other_workers=False, **kwargs):
+        return self.client.submit(
+            fn,
+            *args,
+            workers=worker,
+            allow_other_workers=allow_other_workers,
+            **kwargs,
+        )
+
+    def post_queries(self, queries, scores, done, replace=False):
+        if len(queries) and len(scores):
+            queries = self.client.scatter(queries)
+            scores = self.client.scatter(scores)
+        else:
+            queries = scores = []
+        return self._submit(
+            type(self.sampler).post_queries,
+            self.handle,
+            queries,
+            scores,
+            done=done,
+            replace=replace,
+            worker=self.post_worker,
+            allow_other_workers=True,
+        )
+
+    def process_answers(self, answers, done):
+        return self._submit(
+            _process_answers, self.model, answers, worker=self.model_worker
+        )
+
+    def get_queries(self, delta, stop):
+        return self._submit(
+            _get_queries, self.search, delta, stop=stop, worker=self.search_worker
+        )
+
+    def futures(self, *running) -> list:
+        """
+        Get the Dask futures to cancel on reset.
+        """
+        return list(running) + [self.model, self.search, self.handle]
+
+
+class _ActorExecution(_FuturesExecution):
+    """
+    Run the sampler replicas as long-lived Dask actors.
+
+    Calling an actor's method doesn't go through the scheduler, so this has
+    less overhead per iteration than ``_FuturesExecution``.
+    """
+
+    def __init__(self, sampler: "Sampler", client: "DaskClient"):
+        from concurrent.futures import ThreadPoolExecutor
+
+        super().__init__(sampler, client)
+        # Actor futures don't support callbacks; wait for them in threads.
+        self._pool = ThreadPoolExecutor(max_workers=2)
+
+    def start(self) -> bool:
+        if self.model is not None and self.search is not None:
+            return False
+        futures = [
+            self._submit(SamplerActor, self.sampler, worker=w, actor=True)
+            for w in [self.model_worker, self.search_worker]
+        ]
+        self.model, self.search = [f.result() for f in futures]
+        return True
+
+    def process_answers(self, answers, done):
+        f = self.model.process_answers(answers, done=done)
+        return self._pool.submit(f.result)
+
+    def get_queries(self, delta, stop):
+        f = self.search.get_queries(delta, stop=stop)
+        return self._pool.submit(f.result)
+
+    def close(self):
+        super().close()
+        self._pool.shutdown(wait=False)
+
+    def futures(self, *running) -> list:
+        from concurrent.futures import Future
+
+        running = [f for f in running if not isinstance(f, Future)]
+        return running + [self.handle]
+
+
+class _LocalExecution(_FuturesExecution):
+    """
+    Run the sampler replicas in this process with a thread pool.
+
+    This is used when the Dask cluster is too small to give each of
+    ``post_queries``, ``process_answers`` and ``get_queries`` its own worker.
+    """
+
+    def __init__(self, sampler: "Sampler", client: "DaskClient"):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.sampler = sampler
+        self.client = client
+        self.handle = sampler.handle()
+        self.model = self.search = None
+        self._pool = ThreadPoolExecutor(max_workers=3)
+
+    def start(self) -> bool:
+        if self.model is not None and self.search is not None:
+            return False
+        self.model = deepcopy(self.sampler)
+        self.search = deepcopy(self.sampler)
+        return True
+
+    def event(self):
+        return threading.Event()
+
+    def post_queries(self, queries, scores, done, replace=False):
+        post = type(self.sampler).post_queries
+        return self._pool.submit(
+            post, self.handle, queries, scores, done=done, replace=replace
+        )
+
+    def process_answers(self, answers, done):
+        return self._pool.submit(_process_answers, self.model, answers)
+
+    def get_queries(self, delta, stop):
+        return self._pool.submit(_get_queries, self.search, delta, stop=stop)
+
+    def close(self):
+        super().close()
+        self._pool.shutdown(wait=False)
+
+    def futures(self, *running) -> list:
+        return []
+
+
+def _auto_execution(sampler: "Sampler", client: "DaskClient"):
+    n_workers = len(client.has_what())
+    if n_workers >= 3:
+        return _FuturesExecution(sampler, client)
+    logger.warning(
+        "Only %s Dask worker(s); running %s with execution='local'",
+        n_workers,
+        sampler.ident,
+    )
+    return _LocalExecution(sampler, client)
+
+
+_EXECUTIONS = {
+    "auto": _auto_execution,
+    "futures": _FuturesExecution,
+    "actors": _ActorExecution,
+    "local": _LocalExecution,
+}
+
+
 class Sampler:
     """
     Run a sampling algorithm. Provides hooks to connect with the database and
@@ -25,10 +346,39 @@ class Sampler:
     ident : str
         The algorithm idenfifier. This value is used to identify the algorithm
         in the database.
+    execution : str, optional (default: ``"auto"``)
+        How :meth:`run` uses the Dask cluster. With ``"futures"``, the
+        sampler's replicas are Dask futures pinned to workers. With
+        ``"actors"``, they're long-lived Dask actors. With ``"local"``,
+        they're run in this process with a thread pool. ``"auto"`` uses
+        ``"futures"`` if there are at least 3 Dask workers and ``"local"``
+        otherwise.
+    pool_size : int, optional (default: ``2 ** 18``)
+        The maximum number of queries to keep in the database. The lowest
+        scoring queries are removed when more queries are posted.
     """
 
-    def __init__(self, ident: str = ""):
+    #: How queries are stored in the database, ``"str"`` or ``"binary"``.
+    #: This is set from ``sampling.query_encoding`` in the experiment config.
+    query_encoding = "str"
+
+    #: The maximum number of queries to keep in the database.
+    pool_size = 2 ** 18
+
+    #: When there's nothing to do, wait for answers (or a reset) so each
+    #: iteration of :meth:`run` takes at least this many seconds.
+    idle_period = 1.0
+
+    def __init__(
+        self, ident: str = "", execution: str = "auto", pool_size: int = 2 ** 18
+    ):
+        if execution not in _EXECUTIONS:
+            raise ValueError(
+                f"execution={execution} not in {list(_EXECUTIONS.keys())}"
+            )
         self.ident = ident
+        self.execution = execution
+        self.pool_size = pool_size
         self.meta_ = []
 
     def redis_client(self, decode_responses=True) -> "RedisClient":
@@ -54,24 +404,38 @@ class Sampler:
         Notes
         -----
         This function runs the adaptive algorithm. Because it's asynchronous,
-        this function should return if
-        ``"reset" in rj.keys() and rj.jsonget("reset")``.
+        this function should return if ``rj.jsonget("reset")``. The frontend
+        publishes ``"reset"`` on ``EVENT_CHANNEL`` when that's set, and
+        ``"answers-{ident}"`` when answers are received. If an iteration had
+        nothing to do (no answers and took less than ``idle_period``
+        seconds), the next iteration waits for one of those events for the
+        rest of ``idle_period`` seconds (unless answers were announced
+        during the iteration).
+
+        The sampler is sent to the Dask workers once. One replica processes
+        answers and one replica searches for queries, and each stays on a
+        (pinned) worker between iterations (as a future or an actor,
+        depending on ``execution``). After the model is updated, only the
+        changes from :meth:`get_delta` are sent to the search replica and
+        applied to this object (with :meth:`apply_delta`).
 
         """
-        import dask.distributed as distributed
         from redis.exceptions import ResponseError
         from rejson import Path
         root = Path.rootPath()
 
         rj = self.redis_client()
+        events = _Events(rj, self.ident)
+        reset_deadline = time() + 5
+        idle = 0.0  # seconds to wait for events before the next iteration
 
         answers: List = []
         logger.info(f"Staring {self.ident}")
 
-        def submit(fn: str, *args, allow_other_workers=True, **kwargs):
-            if "workers" in kwargs:
-                kwargs.update({"allow_other_workers": allow_other_workers})
-            return client.submit(getattr(type(self), fn), *args, **kwargs,)
+        execution = getattr(self, "execution", "auto")
+        logger.info("Running %s with execution=%s", self.ident, execution)
+        ex = _EXECUTIONS[execution](self, client)
+        delta = None  # the latest changes the search replica hasn't seen
 
         update = False
         queries = np.array([])
@@ -84,46 +448,31 @@ class Sampler:
         error_raised: List[int] = []
         for k in itertools.count():
             try:
+                # (don't wait if answers were announced since the last read)
+                if idle > 0 and not events.pending:
+                    events.wait(timeout=idle)
+                events.pending = False
+
                 loop_start = time()
                 datum = {"iteration": k, "ident": self.ident, "time": time()}
 
                 answers = self.get_answers(rj, clear=True)
                 datum["num_answers"] = len(answers)
-                self_future = client.scatter(self)
+                __start = time()
+                if ex.start():
+                    delta = None
+                    datum["time_scatter"] = time() - __start
 
                 _start = time()
-                if len(queries) and len(scores):
-                    queries_f = client.scatter(queries)
-                    scores_f = client.scatter(scores)
-                else:
-                    queries_f = scores_f = []
-                if update:
-                    datum["cleared_queries"] = True
-                    __start = time()
-                    self.clear_queries(rj)
-                    datum["time_clearing"] = time() - __start
-                else:
-                    datum["cleared_queries"] = False
-                done = distributed.Event(name="pa_finished")
+                # If the model was updated, replace the queries in the
+                # database (instead of clearing them before posting)
+                datum["cleared_queries"] = bool(update)
+                done = ex.event()
                 done.clear()
 
-                workers = list(client.has_what())
-                random.shuffle(workers)
-                f_post = submit(
-                    "post_queries",
-                    self_future,
-                    queries_f,
-                    scores_f,
-                    done=done,
-                    workers=workers[0],
-                )
-                f_model = submit(
-                    "process_answers", self_future, answers, workers=workers[1],
-                )
-
-                f_search = submit(
-                    "get_queries", self_future, stop=done, workers=workers[2],
-                )
+                f_post = ex.post_queries(queries, scores, done, replace=update)
+                f_model = ex.process_answers(answers, done)
+                f_search = ex.get_queries(delta, done)
 
                 time_model = 0.0
                 time_post = 0.0
@@ -148,9 +497,10 @@ class Sampler:
                 f_search.add_done_callback(_search_done)
 
                 # Future.result raises errors automatically
-                posted = f_post.result()
-                new_self, update = f_model.result()
-                queries, scores, search_meta = f_search.result()
+                posted, update, delta, time_update, search = _gather(
+                    self, f_post, f_model, f_search
+                )
+                queries, scores, search_meta = search
 
                 _datum_update = {
                     "n_queries_posted": posted,
@@ -165,10 +515,8 @@ class Sampler:
                     **search_meta,
                 }
                 datum.update(_datum_update)
+                datum["time_update"] = time_update
                 if update:
-                    _s = time()
-                    self.__dict__.update(new_self.__dict__)
-                    datum["time_update"] = time() - _s
                     n_model_updates += 1
 
                 if time() > save_deadline + 1e-3:
@@ -177,6 +525,7 @@ class Sampler:
                     self.save()
                     datum["time_save"] = time() - _s
                 datum["time_loop"] = time() - loop_start
+                idle = 0 if len(answers) else self.idle_period - datum["time_loop"]
 
                 data.append(datum)
                 logger.info(datum)
@@ -221,21 +570,36 @@ class Sampler:
 
                     data = []
 
-                if "reset" in rj.keys() and rj.jsonget("reset", root):
-                    logger.warning(f"Resetting {self.ident}")
-                    self.reset(client, rj, futures=[f_model, f_post, f_search])
-                    break
+                events.wait()
+                if events.reset or time() >= reset_deadline:
+                    # (also check every few seconds in case the event
+                    # was missed)
+                    reset_deadline = time() + 5
+                    events.reset = False
+                    if rj.jsonget("reset", root):
+                        logger.warning(f"Resetting {self.ident}")
+                        futures = ex.futures(f_model, f_post, f_search)
+                        self.reset(client, rj, futures=futures)
+                        break
 
             except Exception as e:
                 logger.exception(e)
                 flush_logger(logger)
                 error_raised.append(k)
 
+                # The replicas might be partially updated; send this object
+                # to the workers again.
+                ex.stop()
+
                 __n = 5
                 if np.diff(error_raised[-__n:]).tolist() == [1] * (__n - 1):
                     logger.exception(e)
                     flush_logger(logger)
+                    ex.close()
+                    events.close()
                     raise e
+        ex.close()
+        events.close()
         return True
 
     def save(self) -> bool:
@@ -282,18 +646,9 @@ class Sampler:
         logger.warning(f"Clearing answers for {self.ident}")
         self.get_answers(rj, clear=True)
 
-        # Clear queries (twice)
+        # Clear queries (and again after restarting Dask, in case a post
+        # was still running)
         logger.warning(f"Clearing queries for {self.ident}")
-        key = f"alg-{self.ident}-queries"
-        for k in range(4, 18):
-            limit = 2 ** k
-            rj.zremrangebyscore(key, -limit, limit)
-            sleep(0.1)
-            n_queries = rj.zcard(key)
-            logger.warning(f"n_queries={n_queries}")
-            if not n_queries:
-                break
-        logger.warning(f"Clearing queries again for {self.ident}")
         self.clear_queries(rj)
 
         if futures:
@@ -309,12 +664,55 @@ class Sampler:
             pass
 
         client.run(garbage_collect)
+        self.clear_queries(rj)
 
         logger.warning(f"Setting stopped-{self.ident}")
         rj.jsonset(f"stopped-{self.ident}", Path("."), True)
+        rj.publish(EVENT_CHANNEL, f"stopped-{self.ident}")
         logger.warning(f"All done stopping {self.ident}")
         return True
 
+    def handle(self) -> "Sampler":
+        """
+        Get a copy of this sampler without any state, for tasks that only
+        talk to the database (e.g., :meth:`post_queries`).
+        """
+        handle = type(self).__new__(type(self))
+        handle.ident = self.ident
+        handle.query_encoding = self.query_encoding
+        handle.pool_size = self.pool_size
+        return handle
+
+    def get_delta(self, answers: List[Answer]) -> Dict[str, Any]:
+        """
+        Get the changes to this sampler's state from the last call to
+        ``process_answers(answers)``.
+
+        Parameters
+        ----------
+        answers : List[Answers]
+            The answers passed to ``process_answers``.
+
+        Returns
+        -------
+        delta : Dict[str, Any]
+            The changes to send to other copies of this sampler. By default,
+            this is every attribute. Subclasses with large state should only
+            include what changed.
+        """
+        return dict(self.__dict__)
+
+    def apply_delta(self, delta: Dict[str, Any]):
+        """
+        Update this sampler with changes from :meth:`get_delta`.
+
+        Parameters
+        ----------
+        delta : Dict[str, Any]
+            The output of :meth:`get_delta` on another copy of this sampler.
+        """
+        self.__dict__.update(delta)
+
     @property
     def clear(self):
         """
@@ -378,19 +776,38 @@ class Sampler:
         """
         Clear all queries that this sampler has posted from the database.
         """
-        rj.delete(f"alg-{self.ident}-queries")
+        key = f"alg-{self.ident}-queries"
+        rj.delete(key, f"{key}-shadow")
         return True
 
+    def swap_queries(self, rj: "RedisClient") -> int:
+        """
+        Atomically replace the queries in the database with the queries in
+        the shadow pool (if the shadow pool has any queries).
+
+        Returns
+        -------
+        n_queries : int
+            The number of queries in the database after the swap.
+        """
+        key = f"alg-{self.ident}-queries"
+        swap = rj.register_script(_SWAP_QUERIES)
+        return swap(keys=[f"{key}-shadow", key])
+
     def post_queries(
         self,
         queries: List[Query],
         scores: List[float],
         rj: Optional["RedisClient"] = None,
         done=None,
+        replace: bool = False,
     ) -> int:
         """
         Post scored queries to the database.
 
+        At most ``pool_size`` queries are kept in the database; the lowest
+        scoring queries are removed.
+
         Parameters
         ----------
         queries : List[Query]
@@ -399,6 +816,13 @@ class Sampler:
             The scores for each query
         rj : RedisClient, optional
             The databaase
+        done : Event, optional
+            Stop posting when ``done.is_set()``.
+        replace : bool, optional (default: ``False``)
+            If True, replace the queries in the database. The new queries
+            are posted to a shadow pool, which is swapped in with
+            :meth:`swap_queries` when posting finishes, so the database is
+            never without queries.
 
         Returns
         -------
@@ -408,7 +832,9 @@ class Sampler:
         if rj is None:
             rj = self.redis_client()
 
+        key = f"alg-{self.ident}-queries"
         if not len(queries):
+            # Keep serving the old queries instead of emptying the pool
             return 0
 
         if isinstance(queries, np.ndarray) and isinstance(scores, np.ndarray):
@@ -426,25 +852,50 @@ class Sampler:
             low = scores[-1]
             assert low <= high, f"high={high} to low={low} scores"
 
+            # Only the top queries would be kept in the database
+            pool_size = getattr(self, "pool_size", None)
+            if pool_size:
+                queries, scores = queries[:pool_size], scores[:pool_size]
+
+        members = self.serialize_queries(queries)
+        scores = np.asarray(scores, dtype="float64").tolist()
+
+        # Send every chunk in a pipeline (without waiting for a reply), and
+        # only wait for Redis every ``flush_every`` chunks.
         chunk_size = 2000
-        n_chunks = len(queries) // chunk_size
-        split_queries = np.array_split(queries, max(n_chunks, 1))
-        split_scores = np.array_split(scores, max(n_chunks, 1))
-
-        n_queries = 0
-        name = self.ident
-        key = f"alg-{name}-queries"
-        for _queries, _scores in zip(split_queries, split_scores):
-            queries2 = {
-                self.serialize_query(q): float(s)
-                for q, s in zip(_queries, _scores)
-                if not np.isnan(s)
+        flush_every = 10
+        pool_size = getattr(self, "pool_size", None)
+        dest = f"{key}-shadow" if replace else key
+        pipe = rj.pipeline(transaction=False)
+        if replace:
+            pipe.delete(dest)
+
+        def _flush():
+            if pool_size:
+                # remove the lowest scoring queries
+                pipe.zremrangebyrank(dest, 0, -pool_size - 1)
+            pipe.execute()
+
+        n_queries = n_pending = 0
+        for i, k in enumerate(range(0, len(members), chunk_size)):
+            chunk = {
+                m: s
+                for m, s in zip(members[k : k + chunk_size], scores[k : k + chunk_size])
+                if s == s  # not NaN
             }
-            if len(queries2):
-                rj.zadd(key, queries2)
-            n_queries += len(queries2)
-            if done is not None and done.is_set():
-                break
+            if len(chunk):
+                pipe.zadd(dest, chunk)
+            n_pending += len(chunk)
+            if (i + 1) % flush_every == 0:
+                _flush()
+                n_queries += n_pending
+                n_pending = 0
+                if done is not None and done.is_set():
+                    break
+        n_queries += n_pending
+        _flush()
+        if replace:
+            self.swap_queries(rj)
 
         return n_queries
 
@@ -456,20 +907,84 @@ class Sampler:
         h, a, b = q
         return f"{h}-{a}-{b}"
 
+    def serialize_queries(self, queries: List[Query]) -> List[Union[str, bytes]]:
+        """
+        Serialize many queries. This is the same as calling
+        :meth:`serialize_query` on each query, but faster for integer arrays.
+
+        If ``query_encoding == "binary"``, each query is packed into bytes
+        instead (three little-endian ``uint16``, or ``uint32`` if any index
+        is at least ``2**16``).
+        """
+        if self.query_encoding == "binary":
+            Q = np.asarray(queries)
+            dtype = "<u2" if Q.max() < 2 ** 16 else "<u4"
+            Q = np.ascontiguousarray(Q.astype(dtype).reshape(-1, 3))
+            return Q.view(f"V{Q.itemsize * 3}").ravel().tolist()
+        fast = (
+            type(self).serialize_query is Sampler.serialize_query
+            and isinstance(queries, np.ndarray)
+            and queries.dtype.kind in "iu"
+            and queries.ndim == 2
+        )
+        if fast:
+            # One string format in C instead of one per query
+            fmt = "%d-%d-%d\n" * len(queries)
+            return (fmt % tuple(queries.ravel().tolist())).split("\n")[:-1]
+        return [self.serialize_query(q) for q in queries]
+
     def get_answers(self, rj: "RedisClient", clear: bool = True) -> List[Answer]:
         """
         Get all answers the frontend has received.
-        """
-        from rejson import Path
-        root = Path.rootPath()
 
-        if not clear:
-            raise NotImplementedError
+        The frontend adds answers to the Redis stream ``alg-{ident}-answers``
+        (with ``XADD``). If ``clear``, new answers are read with a consumer
+        group (so every answer is read once, even if the frontend adds
+        answers while they're read) and deleted from the stream. Otherwise,
+        every answer in the stream is returned.
+        """
         key = f"alg-{self.ident}-answers"
-        if key in rj.keys():
+        if not clear:
+            return [json.loads(fields["answer"]) for _, fields in rj.xrange(key)]
+
+        from redis.exceptions import ResponseError
+
+        self._create_answer_group(rj, key)
+        try:
+            streams = rj.xreadgroup(ANSWER_GROUP, self.ident, {key: ">"})
+        except ResponseError as e:
+            # The database was flushed after the group was created
+            if "NOGROUP" not in str(e):
+                raise
+            _ANSWER_GROUPS.discard(key)
+            self._create_answer_group(rj, key)
+            streams = rj.xreadgroup(ANSWER_GROUP, self.ident, {key: ">"})
+        if not streams:
+            return []
+        ((_, entries),) = streams
+        ids = [i for i, _ in entries]
+        pipe = rj.pipeline(transaction=False)
+        pipe.xack(key, ANSWER_GROUP, *ids)
+        pipe.xdel(key, *ids)
+        pipe.execute()
+        return [json.loads(fields["answer"]) for _, fields in entries]
+
+    def _create_answer_group(self, rj: "RedisClient", key: str):
+        from redis.exceptions import ResponseError
+
+        if key in _ANSWER_GROUPS:
+            return
+        if rj.type(key) == "ReJSON-RL":
+            # Answers from before the frontend used streams
             pipe = rj.pipeline()
-            pipe.jsonget(key, Path("."))
-            pipe.jsonset(key, Path("."), [])
-            answers, success = pipe.execute()
-            return answers
-        return []
+            pipe.jsonget(key)
+            pipe.delete(key)
+            answers, _ = pipe.execute()
+            for answer in answers or []:
+                rj.xadd(key, {"answer": json.dumps(answer)})
+        try:
+            rj.xgroup_create(key, ANSWER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        _ANSWER_GROUPS.add(key)
@@ -0,0 +1,229 @@
+import json
+
+import numpy as np
+import pytest
+
+from salmon.backend.sampler import Sampler
+
+
+class FakePipeline:
+    def __init__(self, db):
+        self.db = db
+        self.commands = []
+        self.n_executes = 0
+
+    def zadd(self, key, mapping):
+        self.commands.append(lambda: self.db.setdefault(key, {}).update(mapping))
+
+    def zremrangebyrank(self, key, start, stop):
+        def _zremrangebyrank():
+            ranked = sorted(self.db.get(key, {}).items(), key=lambda kv: kv[1])
+            stop_ = stop + len(ranked) + 1 if stop < 0 else stop + 1
+            for m, _ in ranked[start:stop_]:
+                self.db[key].pop(m)
+
+        self.commands.append(_zremrangebyrank)
+
+    def delete(self, *keys):
+        self.commands.append(lambda: [self.db.pop(k, None) for k in keys])
+
+    def execute(self):
+        for command in self.commands:
+            command()
+        self.commands = []
+        self.n_executes += 1
+
+
+class FakeRedis:
+    def __init__(self):
+        self.db = {}
+        self.pipelines = []
+
+    def pipeline(self, transaction=True):
+        pipe = FakePipeline(self.db)
+        self.pipelines.append(pipe)
+        return pipe
+
+
+class FakeStreams:
+    """
+    The Redis stream commands Sampler.get_answers uses.
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.groups = {}
+        self.n_ids = 0
+
+    def type(self, key):
+        return "stream" if key in self.streams else "none"
+
+    def xadd(self, key, fields):
+        self.n_ids += 1
+        self.streams.setdefault(key, []).append((f"{self.n_ids}-0", fields))
+
+    def xrange(self, key):
+        return list(self.streams.get(key, []))
+
+    def xlen(self, key):
+        return len(self.streams.get(key, []))
+
+    def xgroup_create(self, key, group, id="0", mkstream=False):
+        self.streams.setdefault(key, [])
+        self.groups.setdefault((key, group), 0)
+
+    def xreadgroup(self, group, consumer, streams):
+        ((key, _),) = streams.items()
+        last = self.groups[(key, group)]
+        new = [(i, f) for i, f in self.streams[key] if int(i.split("-")[0]) > last]
+        if not new:
+            return []
+        self.groups[(key, group)] = int(new[-1][0].split("-")[0])
+        return [[key, new]]
+
+    def xack(self, key, group, *ids):
+        pass
+
+    def xdel(self, key, *ids):
+        self.streams[key] = [(i, f) for i, f in self.streams[key] if i not in ids]
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+
+def test_serialize_queries():
+    sampler = Sampler(ident="foo")
+    queries = np.random.RandomState(42).choice(1000, size=(100, 3))
+    expected = [sampler.serialize_query(q) for q in queries]
+    assert sampler.serialize_queries(queries) == expected
+    assert sampler.serialize_queries(queries.tolist()) == expected
+
+
+def test_post_queries_pipelined():
+    rng = np.random.RandomState(42)
+    queries = rng.choice(1000, size=(50_000, 3))
+    scores = rng.uniform(size=len(queries))
+    scores[:10] = np.nan
+
+    rj = FakeRedis()
+    sampler = Sampler(ident="foo")
+    n_posted = sampler.post_queries(queries, scores, rj=rj)
+
+    posted = rj.db["alg-foo-queries"]
+    assert n_posted == len(queries) - 10
+    assert len(posted) == len(np.unique(queries[10:], axis=0))
+    assert max(posted.values()) == np.nanmax(scores)
+    # 25 chunks of 2000 queries -> 3 round trips
+    (pipe,) = rj.pipelines
+    assert pipe.n_executes == 3
+
+
+def test_post_queries_bounded_pool():
+    rng = np.random.RandomState(42)
+    queries = np.array([[i, i + 1, i + 2] for i in range(30_000)])
+    scores = rng.uniform(size=len(queries))
+
+    rj = FakeRedis()
+    sampler = Sampler(ident="foo", pool_size=1000)
+    sampler.post_queries(queries, scores, rj=rj)
+    sampler.post_queries(queries + 50_000, scores - 1, rj=rj)
+
+    posted = rj.db["alg-foo-queries"]
+    assert len(posted) == 1000
+    assert min(posted.values()) >= np.sort(scores)[-1000]
+
+
+def test_post_queries_replace():
+    fakeredis = pytest.importorskip("fakeredis")
+    rj = fakeredis.FakeStrictRedis()
+    key = "alg-foo-queries"
+
+    rng = np.random.RandomState(42)
+    queries = rng.choice(1000, size=(100, 3))
+    scores = rng.uniform(size=len(queries))
+
+    sampler = Sampler(ident="foo")
+    sampler.post_queries(queries, scores, rj=rj)
+    old = set(m.decode() for m in rj.zrange(key, 0, -1))
+
+    new_queries = queries + 1000
+    n_posted = sampler.post_queries(new_queries, scores, rj=rj, replace=True)
+    posted = set(m.decode() for m in rj.zrange(key, 0, -1))
+    assert n_posted == len(new_queries)
+    assert posted == set(sampler.serialize_queries(new_queries))
+    assert not old & posted
+    assert not rj.exists(f"{key}-shadow")
+
+    # The pool is never emptied, even if there's nothing to swap in
+    assert sampler.post_queries([], [], rj=rj, replace=True) == 0
+    nan = np.full(len(queries), np.nan)
+    nan[0] = 1
+    assert sampler.post_queries(queries, nan, rj=rj, replace=True) == 1
+    assert rj.zcard(key) == 1
+    assert sampler.swap_queries(rj) == 1
+
+
+@pytest.mark.parametrize("n", [100, 2 ** 17])
+def test_binary_query_encoding(n):
+    from salmon.triplets.manager import deserialize_query
+
+    sampler = Sampler(ident="foo")
+    sampler.query_encoding = "binary"
+    queries = np.random.RandomState(42).choice(n, size=(100, 3))
+    queries[0] = [n - 1, 0, 1]
+    members = sampler.serialize_queries(queries)
+    size = 6 if n <= 2 ** 16 else 12
+    assert all(isinstance(m, bytes) and len(m) == size for m in members)
+
+    for (h, l, r), m in zip(queries, members):
+        q = deserialize_query(m, encoding="binary")
+        assert q["head"] == h and {q["left"], q["right"]} == {l, r}
+
+    # the handle used to post queries uses the same encoding
+    assert sampler.handle().serialize_queries(queries) == members
+
+
+def test_get_answers_stream():
+    rj = FakeStreams()
+    key = "alg-foo-answers"
+    sampler = Sampler(ident="foo")
+    assert sampler.get_answers(rj) == []
+
+    answers = [{"head": i, "winner": i + 1, "puid": "bar"} for i in range(10)]
+    for ans in answers[:6]:
+        rj.xadd(key, {"answer": json.dumps(ans)})
+    assert sampler.get_answers(rj, clear=False) == answers[:6]
+    assert sampler.get_answers(rj) == answers[:6]
+
+    # answers added after reading are read next time (and only once)
+    for ans in answers[6:]:
+        rj.xadd(key, {"answer": json.dumps(ans)})
+    assert sampler.get_answers(rj) == answers[6:]
+    assert sampler.get_answers(rj) == []
+    assert rj.xlen(key) == 0
+
+
+def test_events():
+    fakeredis = pytest.importorskip("fakeredis")
+    from salmon.backend.sampler import _Events
+    from salmon.utils import EVENT_CHANNEL
+
+    rj = fakeredis.FakeStrictRedis(decode_responses=True)
+    events = _Events(rj, "foo")
+    assert not events.wait(timeout=0.05)
+
+    rj.publish(EVENT_CHANNEL, "answers-bar")
+    assert not events.wait()
+    assert not events.pending
+    rj.publish(EVENT_CHANNEL, "answers-foo")
+    assert events.wait(timeout=10)
+    assert events.pending and not events.reset
+    events.pending = False
+
+    rj.publish(EVENT_CHANNEL, "reset")
+    assert events.wait()
+    assert events.reset and not events.pending
+    events.close()
@@ -1,4 +1,5 @@
 import asyncio
+import csv
 import hashlib
 import itertools
 import json
@@ -12,17 +13,18 @@ from copy import deepcopy
 from datetime import datetime, timedelta
 from io import StringIO
 from textwrap import dedent
-from time import sleep, time
-from typing import Any, Dict, List, Optional
+from time import time
+from typing import Any, Dict, Iterator, List, Optional
 
 import numpy as np
 import pandas as pd
-import requests as httpx
+import requests
+import ujson
 import yaml
 from bokeh.embed import json_item
-from fastapi import Depends, File, Form, HTTPException
+from fastapi import Depends, File, Form, HTTPException, Query
 from fastapi.responses import (FileResponse, HTMLResponse, JSONResponse,
-                               PlainTextResponse)
+                               PlainTextResponse, Response, StreamingResponse)
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from redis import ResponseError
 from rejson import Client, Path
@@ -32,11 +34,13 @@ from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_409_CONFLICT
 
 import salmon
 from salmon.frontend import plotting
-from salmon.frontend.public import _ensure_initialized, app, templates
+from salmon.frontend.public import (BACKEND_URL, _ensure_initialized, _run,
+                                    app, backend, templates)
 from salmon.frontend.utils import (ServerException, _extract_zipfile,
                                    _format_target, _format_targets, get_logger)
 from salmon.triplets import manager
 from salmon.triplets.manager import Config
+from salmon.utils import EVENT_CHANNEL
 
 security = HTTPBasic()
 
@@ -419,13 +423,15 @@ async def _process_form(
     rj.jsonset("samplers", root, names)
     rj.jsonset("sampling_probs", root, probs)
     for name in names:
-        rj.jsonset(f"alg-{name}-answers", root, [])
+        # (answers are added to a Redis stream)
+        rj.delete(f"alg-{name}-answers")
 
         # Don't touch! Not set because rj.zadd doesn't require it.
         # rj.jsonset(f"alg-{name}-queries", root, [])
 
         logger.info(f"initializing algorithm {name}...")
-        r = httpx.post(f"http://localhost:8400/init/{name}")
+        # (initializing a sampler can take a while)
+        r = await backend.post(f"/init/{name}", timeout=None)
         if r.status_code != 200:
             msg = "Algorithm errored on initialization.\n\n" + r.text
             logger.error("Error! r.text = %s", r.text)
@@ -436,7 +442,7 @@ async def _process_form(
     _time = time()
     rj.jsonset("start_time", root, _time)
     rj.jsonset("start_datetime", root, datetime.now().isoformat())
-    rj.jsonset("all-responses", root, [])
+    rj.delete("all-responses")
     _save(rj)
 
     nice_config = pprint.pformat(exp_config)
@@ -530,33 +536,42 @@ def _reset(timeout: float = 5):
     _save(rj)
 
     # Stop background jobs (ie adaptive algs)
+    events = rj.pubsub(ignore_subscribe_messages=True)
+    events.subscribe(EVENT_CHANNEL)
     rj.jsonset("reset", root, True)
+    rj.publish(EVENT_CHANNEL, "reset")
     rj2 = Client(host="redis", port=6379, decode_responses=False)
-    if "samplers" in rj.keys():
+    if rj.exists("samplers"):
         samplers = rj.jsonget("samplers")
         stopped = {name: False for name in samplers}
         __deadline = time() + timeout
         for k in itertools.count():
             rj.jsonset("reset", root, True)
+            # The samplers publish "stopped-{name}" after stopping; check the
+            # keys too in case a sampler stopped before we subscribed
             for name in stopped:
-                if f"stopped-{name}" in rj.keys():
-                    stopped[name] = rj.jsonget(f"stopped-{name}", root)
+                stopped[name] = stopped[name] or bool(
+                    rj.jsonget(f"stopped-{name}", root)
+                )
             if all(stopped.values()):
                 logger.warning(f"stopped={stopped}")
                 break
-            sleep(1)
-            logger.warning(
-                f"Waited {k + 1} seconds algorithms... stopped? {stopped}"
-                f" (rj.keys() == {rj.keys()}"
-            )
             if timeout and time() >= __deadline:
                 logger.warning(f"Hit timeout={timeout} w/ stopped={stopped}. Breaking!")
                 break
+            message = events.get_message(timeout=1)
+            while message is not None:
+                data = str(message["data"])
+                if data.startswith("stopped-") and data[8:] in stopped:
+                    stopped[data[8:]] = True
+                message = events.get_message()
+            logger.warning(f"Waited {k + 1} seconds algorithms... stopped? {stopped}")
 
         logger.warning("    starting with clearing queries...")
         for ident in samplers:
             rj2.delete(f"alg-{ident}-queries")
-    httpx.post(f"http://localhost:8400/reset/")
+    events.close()
+    requests.post(f"{BACKEND_URL}/reset/", timeout=30)
 
     logger.warning("Trying to completely flush database...")
 
@@ -584,7 +599,6 @@ def _reset(timeout: float = 5):
     files = [f.name for f in save_dir.glob("*")]
     assert "dump.rdb" not in files
 
-    logger.warning("After reset, rj.keys=%s", rj.keys())
     rj.jsonset("responses", root, {})
     rj.jsonset("start_time", root, -1)
     rj.jsonset("start_datetime", root, "-1")
@@ -594,7 +608,9 @@ def _reset(timeout: float = 5):
 
 @app.get("/responses", tags=["private"])
 async def get_responses(
-    authorized: bool = Depends(_authorize), json: Optional[bool] = True
+    authorized: bool = Depends(_authorize),
+    json: Optional[bool] = True,
+    fmt: Optional[str] = Query(None, alias="format"),
 ) -> Dict[str, Any]:
     """
     Get the recorded responses from the current experiments. This includes
@@ -615,25 +631,106 @@ async def get_responses(
     The list of responses as a CSV file. This file can be read by
     Panda's `read_csv` function.
 
+    With `format=parquet` or `format=arrow`, the responses are a Parquet
+    or Arrow IPC stream file with integer `head`/`winner`/`loser` columns
+    and dictionary encoded target HTML. These files can be read by
+    Panda's `read_parquet` function or `pyarrow.ipc.open_stream`.
+
     """
+    _check_format(fmt)
     exp_config = await _ensure_initialized()
     targets = exp_config["targets"]
     start = rj.jsonget("start_time")
-    responses = await _get_responses()
-    json_responses = await _format_responses(responses, targets, start)
+    if fmt in TABLE_FORMATS:
+        responses = await _get_responses()
+        table = manager.responses_table(responses, targets, start_time=start)
+        return _table_response(table, fmt, "responses")
 
+    # Stream the responses (so they're never all in memory)
+    rows = manager.iter_responses(_iter_responses(), targets, start_time=start)
     if json:
-        return JSONResponse(
-            json_responses,
+        return StreamingResponse(
+            _stream_json(rows),
+            media_type="application/json",
             headers={"Content-Disposition": 'attachment; filename="responses.json"'},
         )
-    with StringIO() as f:
-        df = pd.DataFrame(json_responses)
-        df.to_csv(f, index=False)
-        out = f.getvalue()
+    keys = await _run(_response_keys)
+    return StreamingResponse(
+        _stream_csv(rows, keys=keys),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="responses.csv"'},
+    )
 
-    return PlainTextResponse(
-        out, headers={"Content-Disposition": 'attachment; filename="responses.csv"'}
+
+def _stream_json(rows: Iterator[Dict[str, Any]], chunk_size: int = 1000):
+    yield "["
+    for i, chunk in enumerate(_chunks(rows, chunk_size)):
+        sep = "," if i else ""
+        yield sep + ",".join(ujson.dumps(row) for row in chunk)
+    yield "]"
+
+
+def _stream_csv(
+    rows: Iterator[Dict[str, Any]],
+    keys: Optional[List[str]] = None,
+    chunk_size: int = 1000,
+):
+    """
+    The columns are the keys of the first response, then any other
+    ``keys`` (e.g., from :func:`_response_keys`; responses restored from
+    older versions might have different keys).
+    """
+    columns = None
+    for chunk in _chunks(rows, chunk_size):
+        with StringIO() as f:
+            writer = csv.writer(f)
+            if columns is None:
+                columns = list(chunk[0])
+                columns += [k for k in keys or [] if k not in chunk[0]]
+                writer.writerow(columns)
+            writer.writerows([row.get(c, "") for c in columns] for row in chunk)
+            yield f.getvalue()
+
+
+def _chunks(rows: Iterator[Any], chunk_size: int) -> Iterator[List[Any]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+#: File extensions and media types for the columnar export formats
+TABLE_FORMATS = {
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrows", "application/vnd.apache.arrow.stream"),
+}
+
+
+def _check_format(fmt: Optional[str]):
+    if fmt is not None and fmt not in TABLE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"format={fmt!r} is not one of {list(TABLE_FORMATS)}",
+        )
+
+
+def _table_response(table, fmt: str, name: str) -> Response:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    ext, media_type = TABLE_FORMATS[fmt]
+    sink = pa.BufferOutputStream()
+    if fmt == "parquet":
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return Response(
+        sink.getvalue().to_pybytes(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{ext}"'},
     )
 
 
@@ -655,7 +752,9 @@ def _fmt_embedding(
 
 @app.get("/embeddings", tags=["private"])
 async def get_embeddings(
-    authorized: bool = Depends(_authorize), sampler: Optional[str] = None,
+    authorized: bool = Depends(_authorize),
+    sampler: Optional[str] = None,
+    fmt: Optional[str] = Query(None, alias="format"),
 ):
     """
     Get the embeddings for algorithms.
@@ -664,12 +763,15 @@ async def get_embeddings(
     ----------
 
     * sampler : str, optional. The algorithm to get the embedding for.
+    * format : str, optional. `parquet` or `arrow` to get a Parquet or
+      Arrow IPC stream file instead of a CSV.
 
     Returns
     -------
     CSV with columns for the target HTML, target ID, the embedding, and the
     algorithm generating the embedding.
     """
+    _check_format(fmt)
     exp_config = await _ensure_initialized()
     exp_config = deepcopy(exp_config)
     targets = exp_config.pop("targets")
@@ -694,6 +796,15 @@ async def get_embeddings(
     else:
         df = pd.concat(dfs)
 
+    if fmt in TABLE_FORMATS:
+        import pyarrow as pa
+
+        df = df.astype({"target_html": "category", "alg": "category"})
+        df.columns = [str(c) for c in df.columns]
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        name = "embeddings" if sampler is None else f"embedding-{sampler}"
+        return _table_response(table, fmt, name)
+
     with StringIO() as f:
         df.to_csv(f, index=False)
         out = f.getvalue()
@@ -723,14 +834,39 @@ async def _get_responses():
     This file will be downloaded.
 
     """
-    responses = rj.jsonget("all-responses", root)
-    return responses
+    return list(_iter_responses())
+
 
+def _response_keys() -> List[str]:
+    """
+    Get every key in the recorded responses (in the order they're first
+    seen).
+    """
+    keys: Dict[str, None] = {}
+    for response in _iter_responses():
+        keys.update(dict.fromkeys(response))
+    return list(keys)
 
-async def _format_responses(responses, targets, start):
-    logger.info("getting %s responses", len(responses or []))
-    out = manager.get_responses(responses, targets, start_time=start)
-    return out
+
+def _iter_responses(chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """
+    Get the recorded responses, reading ``chunk_size`` responses from the
+    database at a time.
+    """
+    if rj.type("all-responses") == "ReJSON-RL":
+        # (responses recorded before responses were in a Redis stream)
+        yield from rj.jsonget("all-responses", root) or []
+        return
+    start = "-"
+    while True:
+        entries = rj.xrange("all-responses", min=start, count=chunk_size)
+        for _, fields in entries:
+            yield ujson.loads(fields["answer"])
+        if len(entries) < chunk_size:
+            return
+        # The next ID after the last entry read
+        ms, seq = entries[-1][0].split("-")
+        start = f"{ms}-{int(seq) + 1}"
 
 
 @app.get("/dashboard", tags=["private"])
@@ -986,16 +1122,14 @@ async def restore(
 
 @app.get("/model/{sampler}")
 async def get_model(sampler: str) -> Dict[str, Any]:
-    logger.info("In public get_model with rj.keys() == %s", rj.keys())
-    r = httpx.get(f"http://localhost:8400/model/{sampler}")
+    r = await backend.get(f"/model/{sampler}")
     if r.status_code != 200:
         raise ServerException(r.json()["detail"])
     return r.json()
 
 
 async def _get_alg_perf(sampler: str) -> Dict[str, Any]:
-    logger.info("In private _get_alg_perf with rj.keys() == %s", rj.keys())
-    r = httpx.get(f"http://localhost:8400/meta/perf/{sampler}")
+    r = await backend.get(f"/meta/perf/{sampler}")
     if r.status_code != 200:
         raise ServerException(r.json()["detail"])
     return r.json()
@@ -1,43 +1,66 @@
+import asyncio
 import pathlib
 import random
 from copy import copy
 from datetime import datetime, timedelta
 from textwrap import dedent
 from time import time
-from typing import Dict, Union
+from typing import Any, Dict, List, Union
 
+import httpx
 import numpy as np
-import requests as httpx
 import ujson
 from fastapi import FastAPI
+from prometheus_client import Counter
 from redis.exceptions import ResponseError
 from rejson import Client, Path
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 from starlette.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 from starlette_exporter import PrometheusMiddleware, handle_metrics
 
 from salmon.frontend.utils import ServerException, image_url, sha256
-from salmon.triplets import manager
-from salmon.utils import get_logger
+from salmon.triplets import manager, passive
+from salmon.utils import EVENT_CHANNEL, get_logger
 
 logger = get_logger(__name__)
 
 root = Path.rootPath()
 rj = Client(host="redis", port=6379, decode_responses=True)
+rj_bytes = Client(host="redis", port=6379, decode_responses=False)
 
+# The Redis client is blocking; its calls are run in a thread pool (with
+# ``_run``) so they don't stall the event loop.
+_run = run_in_threadpool
 
-def start_algs():
+#: The address of the backend (salmon.backend.core)
+BACKEND_URL = "http://localhost:8400"
+
+# Keep-alive connections to the backend, shared by every request. The pool
+# and timeouts are bounded so a slow backend can't pile up connections.
+backend = httpx.AsyncClient(
+    base_url=BACKEND_URL,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+    timeout=httpx.Timeout(30, connect=5),
+)
+
+#: The most queries /queries will return at once
+MAX_QUERIES = 100
+
+
+async def start_algs():
     """
     Start the algorithm backend. This function is necessary because the
     machine might be restarted (so the experiment isn't launched fresh).
     """
-    if "samplers" not in rj.keys():
+    if not await _run(rj.exists, "samplers"):
         return
-    names = rj.jsonget("samplers")
+    names = await _run(rj.jsonget, "samplers")
     for name in names:
         logger.info(f"Restarting alg={name}...")
-        r = httpx.post(f"http://localhost:8400/init/{name}")
+        # (restarting a sampler loads its saved state, which can take a while)
+        r = await backend.post(f"/init/{name}", timeout=None)
         assert r.status_code == 200
     return True
 
@@ -47,6 +70,27 @@ def stop_algs():
     return True
 
 
+#: The latency budget for samplers to generate a query (if the config
+#: doesn't have sampling.query_timeout)
+QUERY_TIMEOUT = 0.5
+
+QUERY_TIMEOUTS = Counter(
+    "salmon_query_timeouts",
+    "Requests for a query from a sampler that took longer than the budget",
+    ["sampler"],
+)
+QUERY_SOURCES = Counter(
+    "salmon_query_sources",
+    "Queries served by source: the sampler (backend or frontend), the query "
+    "pool, or random",
+    ["sampler", "source"],
+)
+
+
+async def close_backend():
+    await backend.aclose()
+
+
 app = FastAPI(
     title="Salmon",
     description=dedent(
@@ -55,7 +99,7 @@ app = FastAPI(
         """
     ),
     on_startup=[start_algs],
-    on_shutdown=[stop_algs],
+    on_shutdown=[stop_algs, close_backend],
 )
 app.add_middleware(PrometheusMiddleware)
 app.add_route("/metrics", handle_metrics)
@@ -66,11 +110,23 @@ templates = Jinja2Templates(directory="templates")
 
 
 async def _get_config():
-    return rj.jsonget("exp_config")
+    return await _run(rj.jsonget, "exp_config")
+
+
+async def _get_sampling() -> Dict[str, Any]:
+    """
+    Get the ``sampling`` settings. Settings added after the config was
+    uploaded might be missing.
+    """
+    try:
+        sampling = await _run(rj.jsonget, "exp_config", Path(".sampling"))
+    except ResponseError:
+        sampling = None
+    return sampling or {}
 
 
 async def _ensure_initialized():
-    if "exp_config" not in rj:
+    if not await _run(rj.exists, "exp_config"):
         raise ServerException("No data has been uploaded")
     exp_config = await _get_config()
     expected_keys = ["targets", "samplers", "n", "sampling", "html"]
@@ -128,37 +184,139 @@ async def get_query_page(request: Request, puid: str = ""):
     return templates.TemplateResponse("query_page.html", items)
 
 
-@app.get("/query", tags=["public"])
-async def get_query(sampler="", puid="") -> Dict[str, Union[int, str, float]]:
+def _get_samplers():
+    pipe = rj.pipeline(transaction=False)
+    pipe.jsonget("samplers")
+    pipe.jsonget("sampling_probs")
+    return pipe.execute()
+
+
+async def _choose_sampler(sampler: str = "") -> str:
     if sampler == "":
-        samplers = rj.jsonget("samplers")
-        probs = rj.jsonget("sampling_probs")
+        samplers, probs = await _run(_get_samplers)
 
         idx = np.random.choice(len(samplers), p=probs)
         sampler = samplers[idx]
+    return sampler
+
+
+async def _pop_queries(
+    sampler: str, n: int, encoding: str = "str"
+) -> List[Dict[str, Union[int, str, float]]]:
+    """
+    Pop the ``n`` highest scoring queries the sampler has posted (with one
+    ZPOPMAX). If there aren't enough queries, random queries are returned.
+    """
+    key = f"alg-{sampler}-queries"
+    logger.info(f"zpopmax'ing {n} from {key}")
+    queries = await _run((rj_bytes if encoding == "binary" else rj).zpopmax, key, n)
+    out = []
+    for serialized_query, score in queries:
+        q = manager.deserialize_query(serialized_query, encoding=encoding)
+        out.append({"sampler": sampler, "score": score, **q})
+    QUERY_SOURCES.labels(sampler, "pool").inc(len(out))
+    if len(out) < n:
+        QUERY_SOURCES.labels(sampler, "random").inc(n - len(out))
+        config = await _get_config()
+        for _ in range(n - len(out)):
+            q = manager.random_query(config["n"])
+            out.append({"sampler": sampler, "score": -9999, **q})
+    return out
+
+
+async def _backend_queries(endpoint: str, sampler: str, timeout: float):
+    """
+    Get queries from the sampler (via the backend), or None if the sampler
+    doesn't have any or doesn't respond within ``timeout`` seconds.
+    """
+    try:
+        r = await asyncio.wait_for(backend.get(endpoint), timeout or None)
+    except asyncio.TimeoutError:
+        logger.warning(f"{endpoint} took longer than timeout={timeout}s")
+        QUERY_TIMEOUTS.labels(sampler).inc()
+        return None
+    except httpx.HTTPError as e:
+        logger.warning(f"{endpoint} raised {e!r}")
+        return None
+    if r.status_code != 200:
+        return None
+    logger.info(f"{endpoint} r={r}")
+    return r.json()
+
+
+@app.get("/query", tags=["public"])
+async def get_query(sampler="", puid="") -> Dict[str, Union[int, str, float]]:
+    sampler = await _choose_sampler(sampler)
+    queries = await _run(passive.get_queries, rj, sampler, n=1, puid=puid)
+    if queries is not None:
+        QUERY_SOURCES.labels(sampler, "frontend").inc()
+        return queries[0]
+    sampling = await _get_sampling()
 
-    host = f"http://localhost:8400"
     endpoint = f"/query/{sampler}"
     if puid:
         endpoint = endpoint + f"?puid={puid}"
 
-    r = httpx.get(host + endpoint)
-    if r.status_code == 200:
-        logger.info(f"query r={r}")
-        return r.json()
+    timeout = sampling.get("query_timeout", QUERY_TIMEOUT)
+    q = await _backend_queries(endpoint, sampler, timeout)
+    if q is not None:
+        QUERY_SOURCES.labels(sampler, "backend").inc()
+        return q
 
-    key = f"alg-{sampler}-queries"
-    logger.info(f"zpopmax'ing {key}")
-    queries = rj.zpopmax(key)
-    if len(queries):
-        serialized_query, score = queries[0]
-        q = manager.deserialize_query(serialized_query)
-    else:
-        config = await _get_config()
-        q = manager.random_query(config["n"])
-        score = -9999
+    encoding = sampling.get("query_encoding", "str")
+    (q,) = await _pop_queries(sampler, 1, encoding=encoding)
+    return q
+
+
+@app.get("/queries", tags=["public"])
+async def get_queries(
+    sampler="", puid="", n: int = 10
+) -> List[Dict[str, Union[int, str, float]]]:
+    """
+    Get ``n`` queries at once (so the query page can prefetch queries).
+    If ``sampler`` isn't specified, the sampler is chosen for each query
+    (like in ``/query``).
+    """
+    n = max(1, min(n, MAX_QUERIES))
+    if sampler != "":
+        return await _sampler_queries(sampler, n, puid=puid)
 
-    return {"sampler": sampler, "score": score, **q}
+    samplers, probs = await _run(_get_samplers)
+    drawn = np.random.choice(len(samplers), size=n, p=probs)
+    counts = np.bincount(drawn, minlength=len(samplers))
+    idx = np.flatnonzero(counts)
+    batches = await asyncio.gather(
+        *[_sampler_queries(samplers[i], int(counts[i]), puid=puid) for i in idx]
+    )
+    batches = {i: iter(b) for i, b in zip(idx, batches)}
+    return [next(batches[i]) for i in drawn]
+
+
+async def _sampler_queries(
+    sampler: str, n: int, puid: str = ""
+) -> List[Dict[str, Union[int, str, float]]]:
+    """
+    Get ``n`` queries from ``sampler``. The latency budget is
+    ``query_timeout`` per query, and any queries the sampler doesn't
+    generate come from the query pool.
+    """
+    queries = await _run(passive.get_queries, rj, sampler, n=n, puid=puid)
+    if queries is not None:
+        QUERY_SOURCES.labels(sampler, "frontend").inc(len(queries))
+        return queries
+    sampling = await _get_sampling()
+
+    endpoint = f"/queries/{sampler}?n={n}"
+    if puid:
+        endpoint = endpoint + f"&puid={puid}"
+
+    timeout = n * sampling.get("query_timeout", QUERY_TIMEOUT)
+    queries = await _backend_queries(endpoint, sampler, timeout) or []
+    QUERY_SOURCES.labels(sampler, "backend").inc(len(queries))
+    if len(queries) < n:
+        encoding = sampling.get("query_encoding", "str")
+        queries += await _pop_queries(sampler, n - len(queries), encoding=encoding)
+    return queries
 
 
 @app.post("/answer", tags=["public"])
@@ -180,12 +338,21 @@ async def process_answer(ans: manager.Answer):
         "loser": d["left"] if d["winner"] == d["right"] else d["right"],
     }
     d.update(_update)
-    ident = d["sampler"]
     logger.warning(f"answer received: {d}")
-    rj.jsonarrappend(f"alg-{ident}-answers", root, d)
-    # on backend,  key = f"alg-{self.ident}-answers"
-    rj.jsonarrappend("all-responses", root, d)
-    last_save = rj.lastsave()
+    await _run(_save_answer, d)
+    return {"success": True}
+
+
+def _save_answer(d):
+    ident = d["sampler"]
+    answer = {"answer": ujson.dumps(d)}
+    pipe = rj.pipeline(transaction=False)
+    # on backend, read with Sampler.get_answers
+    pipe.xadd(f"alg-{ident}-answers", answer)
+    pipe.xadd("all-responses", answer)
+    pipe.publish(EVENT_CHANNEL, f"answers-{ident}")
+    pipe.lastsave()
+    *_, last_save = pipe.execute()
 
     # Save every 15 minutes
     if (datetime.now() - last_save) >= timedelta(seconds=60 * 15):
@@ -194,5 +361,3 @@ async def process_answer(ans: manager.Answer):
         except ResponseError as e:
             if "Background save already in progress" not in str(e):
                 raise e
-
-    return {"success": True}
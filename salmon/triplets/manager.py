@@ -1,10 +1,10 @@
+import itertools
 import logging
 import random
 from collections import defaultdict
 from copy import deepcopy
-from datetime import datetime, timedelta
 from textwrap import dedent
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 
 import numpy as np
 from pydantic import BaseModel, BaseSettings, Field, validator
@@ -72,6 +72,31 @@ class Sampling(BaseSettings):
         from one sampler, and ``sampler_per_user=0`` means the user sees a
         new sampler every query""",
     )
+    query_encoding: str = Field(
+        "str",
+        description="""How queries are stored in the database. With
+        ``"str"``, each query is stored as the string ``"head-left-right"``.
+        With ``"binary"``, each query is stored as three packed unsigned
+        integers (6 bytes if there are fewer than 65,536 targets), which uses
+        less memory and is faster to post and pop.""",
+    )
+    query_timeout: float = Field(
+        0.5,
+        description="""The latency budget (in seconds) for a sampler to
+        generate a query in ``/query`` (or for each query in ``/queries``).
+        If a sampler takes longer, the query is the highest scoring query
+        the sampler has posted (or a random query if there are none). Set
+        ``query_timeout=0`` to always wait for the sampler.""",
+    )
+    passive_frontend: bool = Field(
+        True,
+        description="""Whether to generate queries for the passive samplers
+        (:class:`~salmon.triplets.samplers.Random`,
+        :class:`~salmon.triplets.samplers.RoundRobin` and
+        :class:`~salmon.triplets.samplers.Validation`) in the frontend. This
+        avoids a request to the backend for every query, so serving these
+        queries scales with the number of frontend workers.""",
+    )
     details: Dict[int, Any] = Field(
         {},
         description="""Different options for a deterministic choice of samplers.
@@ -328,6 +353,14 @@ class Config(BaseSettings):
             )
             raise ValueError(msg.format(sf, s, sf - s, s - sf))
 
+        if (v := self.sampling.query_encoding) not in {"str", "binary"}:
+            raise ValueError(
+                f"sampling.query_encoding={v} not in ['str', 'binary']"
+            )
+
+        if (v := self.sampling.query_timeout) < 0:
+            raise ValueError(f"sampling.query_timeout={v} must be non-negative")
+
         if (v := self.sampling.samplers_per_user) not in {0, 1}:
             raise NotImplementedError(
                 "Only samplers_per_user in {0, 1} is implemented, not "
@@ -420,8 +453,17 @@ class Config(BaseSettings):
             )
 
 
-def deserialize_query(serialized_query: str) -> Dict[str, int]:
-    h, l, r = serialized_query.split("-")
+def deserialize_query(
+    serialized_query: Union[str, bytes], encoding: str = "str"
+) -> Dict[str, int]:
+    if encoding == "binary":
+        # (h, l, r) as packed little-endian uint16 (or uint32 if n >= 2**16)
+        dtype = "<u2" if len(serialized_query) == 6 else "<u4"
+        h, l, r = np.frombuffer(serialized_query, dtype=dtype).tolist()
+    else:
+        if isinstance(serialized_query, bytes):
+            serialized_query = serialized_query.decode()
+        h, l, r = serialized_query.split("-")
     flip = random.choice([True, False])
     if flip:
         l, r = r, l
@@ -433,34 +475,163 @@ def deserialize_query(serialized_query: str) -> Dict[str, int]:
 
 
 def get_responses(answers: List[Dict[str, Any]], targets, start_time=0):
-    start = start_time
-    out = []
-
-    user_responses = defaultdict(int)
-    for datum in answers:
-        out.append(datum)
-        puid = datum["puid"]
-        user_responses[puid] += 1
-        datetime_received = timedelta(seconds=datum["time_received"]) + datetime(
-            1970, 1, 1
-        )
-        idxs = {
-            key + "_html": targets[datum[key]]
-            for key in ["left", "right", "head", "winner", "loser"]
-        }
-        names = {
-            key + "_filename": _get_filename(idxs[f"{key}_html"])
-            for key in ["left", "right", "head", "winner", "loser"]
-        }
-        meta = {
-            "time_received_since_start": datum["time_received"] - start,
-            "datetime_received": datetime_received.isoformat(),
-            "start_time": start_time,
-            "puid_num_responses": user_responses[puid],
-            "num_responses": sum(user_responses.values()),
+    """
+    Add the target HTML/filenames, receive times and response counts to each
+    answer (in place).
+    """
+    enrich = _ResponseEnricher(targets, start_time=start_time)
+    return enrich(list(answers))
+
+
+def iter_responses(
+    answers: Iterable[Dict[str, Any]], targets, start_time=0, chunk_size=1000
+) -> Iterator[Dict[str, Any]]:
+    """
+    Like :func:`get_responses`, but one response at a time (so ``answers``
+    can be a generator).
+    """
+    enrich = _ResponseEnricher(targets, start_time=start_time)
+    answers = iter(answers)
+    while True:
+        chunk = list(itertools.islice(answers, chunk_size))
+        if not chunk:
+            return
+        yield from enrich(chunk)
+
+
+class _ResponseEnricher:
+    """
+    Add columns to responses with array indexing (instead of looking up
+    targets and formatting times for every response).
+
+    The number of responses (in total and per participant) are tracked
+    between calls.
+    """
+
+    _keys = ["left", "right", "head", "winner", "loser"]
+
+    def __init__(self, targets, start_time=0):
+        self.start_time = start_time
+        html = np.empty(len(targets), dtype=object)
+        html[:] = targets
+        filenames = np.empty(len(targets), dtype=object)
+        filenames[:] = [_get_filename(t) for t in targets]
+        self.html = html
+        self.filenames = filenames
+        self.puid_responses = defaultdict(int)
+        self.num_responses = 0
+
+    def __call__(self, answers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not len(answers):
+            return answers
+        idx = {
+            k: np.fromiter((a[k] for a in answers), dtype=int, count=len(answers))
+            for k in self._keys
         }
-        out[-1].update({**idxs, **names, **meta})
-    return out
+        columns = {f"{k}_html": self.html[idx[k]].tolist() for k in self._keys}
+        columns.update(
+            {f"{k}_filename": self.filenames[idx[k]].tolist() for k in self._keys}
+        )
+
+        received = np.array([a["time_received"] for a in answers])
+        columns["time_received_since_start"] = (received - self.start_time).tolist()
+        columns["datetime_received"] = _isoformat(received)
+        columns["start_time"] = [self.start_time] * len(answers)
+        columns["puid_num_responses"] = self._count([a["puid"] for a in answers])
+        n = self.num_responses
+        columns["num_responses"] = list(range(n + 1, n + len(answers) + 1))
+        self.num_responses += len(answers)
+
+        keys = list(columns.keys())
+        for datum, values in zip(answers, zip(*columns.values())):
+            datum.update(zip(keys, values))
+        return answers
+
+    def _count(self, puids: List[str]) -> List[int]:
+        """
+        Get a cumulative count of responses for each participant.
+        """
+        codes = {}
+        code = np.array([codes.setdefault(p, len(codes)) for p in puids])
+        order = np.argsort(code, kind="stable")
+        sizes = np.bincount(code)
+        starts = np.cumsum(sizes) - sizes
+        rank = np.empty(len(code), dtype=int)
+        rank[order] = np.arange(len(code)) - starts[code[order]]
+
+        base = np.array([self.puid_responses[p] for p in codes])
+        for p, total in zip(codes, base + sizes):
+            self.puid_responses[p] = int(total)
+        return (base[code] + rank + 1).tolist()
+
+
+def _isoformat(seconds: np.ndarray) -> List[str]:
+    """
+    Like ``(datetime(1970, 1, 1) + timedelta(seconds=s)).isoformat()`` for
+    every ``s`` in ``seconds``.
+    """
+    whole = np.floor(seconds)
+    # timedelta rounds to the nearest microsecond (half to even)
+    us = whole.astype("int64") * 10 ** 6 + np.round((seconds - whole) * 1e6).astype(
+        "int64"
+    )
+    out = np.datetime_as_string(us.astype("datetime64[us]"), unit="us").tolist()
+    # isoformat doesn't show microseconds if there are none
+    return [s[:-7] if s.endswith(".000000") else s for s in out]
+
+
+def responses_table(answers: List[Dict[str, Any]], targets, start_time=0):
+    """
+    Get the responses as an Arrow table (e.g., to write to Parquet).
+
+    This has the same columns as :func:`get_responses`, but typed:
+
+    * ``head``, ``left``, ``right``, ``winner`` and ``loser`` are integers.
+    * The ``*_html`` and ``*_filename`` columns are dictionary encoded, with
+      indices ``head`` etc. into the target HTML/filenames.
+    * ``datetime_received`` is a timestamp.
+
+    Returns
+    -------
+    table : pyarrow.Table
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    df = pd.DataFrame(answers)
+    if not len(df):
+        return pa.table({})
+    if "loser" not in df.columns:
+        df["loser"] = np.where(df["winner"] == df["right"], df["left"], df["right"])
+    html = pa.array([str(t) for t in targets], type=pa.string())
+    filenames = pa.array([_get_filename(t) for t in targets], type=pa.string())
+
+    columns = {}
+    for k in df.columns:
+        if k in ["head", "left", "right", "winner", "loser"]:
+            columns[k] = pa.array(df[k].to_numpy(dtype="int32"))
+        elif df[k].dtype == object:
+            columns[k] = pa.array(df[k]).dictionary_encode()
+        else:
+            columns[k] = pa.array(df[k])
+
+    for k in ["left", "right", "head", "winner", "loser"]:
+        idx = columns[k]
+        columns[f"{k}_html"] = pa.DictionaryArray.from_arrays(idx, html)
+        columns[f"{k}_filename"] = pa.DictionaryArray.from_arrays(idx, filenames)
+
+    received = df["time_received"].to_numpy(dtype="float64")
+    num_responses = np.arange(1, len(df) + 1)
+    columns["time_received_since_start"] = pa.array(received - start_time)
+    columns["datetime_received"] = pa.array(
+        (received * 1e6).astype("int64"), type=pa.timestamp("us")
+    )
+    columns["start_time"] = pa.array(np.full(len(df), start_time, dtype="float64"))
+    columns["puid_num_responses"] = pa.array(
+        df.groupby("puid").cumcount().to_numpy() + 1
+    )
+    columns["num_responses"] = pa.array(num_responses)
+    return pa.table(columns)
 
 
 def random_query(n: int) -> Dict[str, int]:
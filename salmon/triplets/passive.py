@@ -0,0 +1,178 @@
+"""
+Generate queries for the passive samplers (Random, RoundRobin and
+Validation) in the frontend, without a request to the backend.
+
+The backend stores a small spec for each passive sampler in Redis when the
+sampler is initialized (see ``passive_spec`` on the samplers). The only
+state shared between frontend workers is a counter in a Redis hash: one per
+participant for RoundRobin, and one for all participants for Validation (and
+Random). The order the heads are shown in is a permutation seeded by the
+participant and how many times they've cycled through the targets.
+RoundRobin's ``max_participants`` and ``participant_ttl`` bound the
+per-participant counters.
+"""
+import json
+import random
+import zlib
+from functools import lru_cache
+from time import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+#: The sampler classes that can be served in the frontend
+PASSIVE_SAMPLERS = ["Random", "RoundRobin", "Validation"]
+
+#: The samplers with a counter for each participant (the others have one
+#: counter for all participants)
+PER_PARTICIPANT = ["RoundRobin"]
+
+# Get the spec and count the queries (if the sampler is passive) in one
+# round trip. KEYS = [spec, counters, last seen], ARGV = [puid, n, now].
+# Participants are evicted like in RoundRobin: the least recently seen after
+# max_participants, and any not seen in participant_ttl seconds.
+_NEXT_QUERIES = """
+local spec = redis.call(
+    "HMGET", KEYS[1], "spec", "per_participant", "max_participants",
+    "participant_ttl"
+)
+if not spec[1] then
+    return false
+end
+local field = ""
+if spec[2] == "1" then
+    field = ARGV[1]
+    local now = tonumber(ARGV[3])
+    local cap = tonumber(spec[3]) or 0
+    local ttl = tonumber(spec[4]) or 0
+    local unpack = unpack or table.unpack  -- (Lua 5.1 or newer)
+    local function evict(puids)
+        for i = 1, #puids, 1000 do
+            local chunk = {unpack(puids, i, math.min(i + 999, #puids))}
+            redis.call("HDEL", KEYS[2], unpack(chunk))
+            redis.call("ZREM", KEYS[3], unpack(chunk))
+        end
+    end
+    redis.call("ZADD", KEYS[3], now, field)
+    if ttl > 0 then
+        evict(redis.call("ZRANGEBYSCORE", KEYS[3], "-inf", "(" .. (now - ttl)))
+    end
+    if cap > 0 then
+        local excess = redis.call("ZCARD", KEYS[3]) - cap
+        if excess > 0 then
+            evict(redis.call("ZRANGE", KEYS[3], 0, excess - 1))
+        end
+    end
+end
+return {spec[1], redis.call("HINCRBY", KEYS[2], field, ARGV[2])}
+"""
+
+
+def spec_key(ident: str) -> str:
+    return f"passive-{ident}"
+
+
+def store_spec(rj, ident: str, spec: Dict[str, Any]):
+    """
+    Store the spec of a passive sampler, so the frontend generates its
+    queries.
+    """
+    key = spec_key(ident)
+    mapping = {
+        "spec": json.dumps(spec),
+        "per_participant": int(spec["class"] in PER_PARTICIPANT),
+    }
+    # Participants are only evicted if their state isn't meant to persist
+    if not spec.get("persist", False):
+        mapping["max_participants"] = spec.get("max_participants", 0)
+        mapping["participant_ttl"] = spec.get("participant_ttl", 0)
+    pipe = rj.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping=mapping)
+    pipe.execute()
+
+
+def get_queries(rj, ident: str, n: int = 1, puid: str = "") -> Optional[List[dict]]:
+    """
+    Generate ``n`` queries for the sampler ``ident`` for participant ``puid``.
+
+    Returns
+    -------
+    queries : Optional[List[dict]]
+        The queries, formatted like the backend's ``/queries`` endpoint.
+        None if the sampler isn't passive (or isn't served in the
+        frontend).
+    """
+    next_queries = rj.register_script(_NEXT_QUERIES)
+    key = spec_key(ident)
+    keys = [key, f"{key}-counters", f"{key}-seen"]
+    out = next_queries(keys=keys, args=[puid, n, time()])
+    if not out:
+        return None
+    spec, counter = out
+    spec = _load(spec.decode() if isinstance(spec, bytes) else spec)
+    return generate(spec, range(int(counter) - n, int(counter)), puid=puid, ident=ident)
+
+
+def generate(
+    spec: Dict[str, Any], counters: range, puid: str = "", ident: str = ""
+) -> List[dict]:
+    """
+    Generate the queries numbered ``counters`` for participant ``puid``.
+    """
+    if spec["class"] == "Random":
+        targets = spec["targets"] or range(spec["n"])
+        queries = [(random.sample(targets, 3), -9999) for _ in counters]
+    elif spec["class"] == "RoundRobin":
+        targets = spec["targets"] or range(spec["n"])
+        queries = [
+            round_robin_query(targets, spec["seed"], puid, c) for c in counters
+        ]
+    elif spec["class"] == "Validation":
+        queries = [_validation(spec, c) for c in counters]
+    else:
+        raise ValueError(f"Can't generate queries for class={spec['class']}")
+    return [
+        {"sampler": ident, "score": score, "head": h, "left": l, "right": r}
+        for (h, l, r), score in queries
+    ]
+
+
+def round_robin_query(targets, seed: int, puid: str, counter: int):
+    """
+    Generate participant ``puid``'s query number ``counter`` (and its score)
+    for the RoundRobin sampler.
+
+    Every target is the head once in every ``len(targets)`` queries. The
+    order is a permutation seeded by ``seed``, ``puid`` and the cycle, so
+    only ``counter`` needs to be stored per participant.
+    """
+    m = len(targets)
+    cycle, idx = divmod(counter, m)
+    pos = int(_order(seed, puid, cycle, m)[idx])
+
+    # the two comparison items are drawn from all targets but the head
+    i, j = random.sample(range(m - 1), 2)
+    i, j = i + (i >= pos), j + (j >= pos)
+    h, a, b = targets[pos], targets[i], targets[j]
+    return (h, a, b), float(max(abs(h - a), abs(h - b)))
+
+
+def _validation(spec, counter):
+    queries = spec["queries"]
+    cycle, idx = divmod(counter, len(queries))
+    h, l, r = queries[_order(spec["seed"], "", cycle, len(queries))[idx]]
+    if random.choice([True, False]):
+        l, r = r, l
+    return (h, l, r), float(idx)
+
+
+@lru_cache(maxsize=256)
+def _order(seed: int, puid: str, cycle: int, m: int) -> np.ndarray:
+    s = zlib.crc32(f"{seed}-{puid}-{cycle}".encode())
+    return np.random.RandomState(s).permutation(m)
+
+
+@lru_cache(maxsize=32)
+def _load(spec: str) -> Dict[str, Any]:
+    return json.loads(spec)
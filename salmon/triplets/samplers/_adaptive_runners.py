@@ -14,6 +14,7 @@ import salmon.triplets.samplers.adaptive as adaptive
 from salmon.backend.sampler import Sampler
 from salmon.triplets.samplers._random_sampling import \
     _get_query as _random_query
+from salmon.triplets.samplers._round_robin import _random_pairs
 from salmon.triplets.samplers.adaptive import InfoGainScorer, UncertaintyScorer
 from salmon.utils import get_logger
 
@@ -23,6 +24,16 @@ Query = TypeVar("Query")
 Answer = TypeVar("Answer")
 
 
+def _alg_answers(answers: List[Answer]) -> List[Tuple[int, int, int]]:
+    # fmt: off
+    return [
+        (a["head"], a["winner"],
+         a["left"] if a["winner"] == a["right"] else a["right"])
+        for a in answers
+    ]
+    # fmt: on
+
+
 class Adaptive(Sampler):
     """
     The sampler that runs adaptive algorithms.
@@ -63,10 +74,26 @@ class Adaptive(Sampler):
             decision boundary (or 50% probability).
         random_state : int, None, optional (default: ``None``)
             The random state to be used for initialization.
+        n_post : int, optional (default: ``2 ** 16``)
+            The number of top-scoring queries to keep from each search (and
+            post to the database).
+        execution : str, optional (default: ``"auto"``)
+            How the Dask cluster is used. With ``"actors"``, the model and
+            search run in long-lived Dask actors. With ``"local"``, they run
+            in a thread pool (which ``"auto"`` chooses when there are fewer
+            than 3 Dask workers). See :class:`~salmon.backend.sampler.Sampler`.
+        pool_size : int, optional (default: ``2 ** 18``)
+            The maximum number of queries to keep in the database.
         kwargs : dict, optional
             Keyword arguments to pass to :class:`~salmon.triplets.samplers.adaptive.Embedding`.
+            Keyword arguments that start with ``scorer__`` are passed to
+            the query scorer instead (e.g., ``scorer__chunk_size``).
         """
-        super().__init__(ident=ident)
+        super().__init__(
+            ident=ident,
+            execution=kwargs.pop("execution", "auto"),
+            pool_size=kwargs.pop("pool_size", 2 ** 18),
+        )
 
         logger.warning(f"Initializing Adaptive with n={n}, d={d}, R={R}")
         self.n = n
@@ -74,6 +101,12 @@ class Adaptive(Sampler):
         self.R = R
 
         self.n_search = kwargs.pop("n_search", 0)
+        self.n_post = kwargs.pop("n_post", 2 ** 16)
+        scorer_kwargs = {
+            k.replace("scorer__", "", 1): kwargs.pop(k)
+            for k in list(kwargs)
+            if k.startswith("scorer__")
+        }
 
         Opt = getattr(adaptive, optimizer)
         Module = getattr(adaptive, module)
@@ -95,9 +128,13 @@ class Adaptive(Sampler):
 
         probs = self.opt.net_.module_.probs
         if scorer == "infogain":
-            search = InfoGainScorer(embedding=self.opt.embedding(), probs=probs)
+            search = InfoGainScorer(
+                embedding=self.opt.embedding(), probs=probs, **scorer_kwargs
+            )
         elif scorer == "uncertainty":
-            search = UncertaintyScorer(embedding=self.opt.embedding(), probs=probs)
+            search = UncertaintyScorer(
+                embedding=self.opt.embedding(), probs=probs, **scorer_kwargs
+            )
         else:
             raise ValueError(f"scorer={scorer} not in ['uncertainty', 'infogain']")
 
@@ -117,6 +154,10 @@ class Adaptive(Sampler):
             **kwargs,
         }
 
+    def __setstate__(self, state):
+        state.setdefault("n_post", 2 ** 16)  # saved before n_post was added
+        self.__dict__.update(state)
+
     def get_query(self, **kwargs) -> Tuple[Optional[Dict[str, int]], Optional[float]]:
         """Randomly select a query where there are few responses"""
         if self.meta["num_ans"] <= self.R * self.n:
@@ -127,53 +168,15 @@ class Adaptive(Sampler):
     def get_queries(
         self, num=None, stop=None, **kwargs
     ) -> Tuple[List[Query], List[float], dict]:
-        """Get and score many queries."""
-        ret_queries = []
-        ret_scores = []
-        n_searched = 0
-        for pwr in range(12, 40 + 1):
-            # I think there's a memory leak in search.score -- Dask workers
-            # kept on dying on get_queries. min(pwr, 16) to fix that (and
-            # verified too).
-            #
-            # pwr in range(12, 41) => about 1.7 million queries searched
-            pwr = min(pwr, 16)
-            queries, scores = self.search.score(num=2 ** pwr)
-            n_searched += len(queries)
-            ret_queries.append(queries)
-            ret_scores.append(scores)
-
-            # returned object is about (n_searched/1e6) * 16 MB in size
-            # let's limit it to be 32MB in size
-            if (n_searched >= 2e6) or (stop is not None and stop.is_set()):
-                break
-            if num or self.n_search:
-                n_ret = int(num or self.n_search)
-                if n_searched >= 3 * n_ret:
-                    break
-
-        queries = np.concatenate(ret_queries).astype(int)
-        scores = np.concatenate(ret_scores)
-        queries = self._sort_query_order(queries)
-
-        ## Rest of this function takes about 450ms
-        df = pd.DataFrame(queries)
-        hashes = pd.util.hash_pandas_object(df, index=False)
-        _, idx = np.unique(hashes.to_numpy(), return_index=True)
-        queries = queries[idx]
-        scores = scores[idx]
-        if num or self.n_search:
-            n_ret = int(num or self.n_search)
-            queries = queries[:n_ret]
-            scores = scores[:n_ret]
-        return queries, scores, {}
-
-    @staticmethod
-    def _sort_query_order(queries: np.ndarray) -> np.ndarray:
-        mins = np.minimum(queries[:, 1], queries[:, 2])
-        maxs = np.maximum(queries[:, 1], queries[:, 2])
-        queries[:, 1], queries[:, 2] = mins, maxs
-        return queries
+        """Get and score many queries.
+
+        About 2 million random queries are searched (or fewer if ``stop`` is
+        set), and the ``num`` highest scoring queries are returned. If ``num``
+        is not specified, ``n_search`` or ``n_post`` queries are returned.
+        """
+        n_ret = int(num or self.n_search or self.n_post)
+        queries, scores, n_searched = self.search.top_k(n_ret, stop=stop)
+        return queries, scores, {"n_queries_scored_(complete)": n_searched}
 
     def process_answers(self, answers: List[Answer]):
         """Process answers from the database.
@@ -192,15 +195,8 @@ class Adaptive(Sampler):
         logger.debug("self.meta = %s", self.meta)
         logger.debug("self.R, self.n = %s, %s", self.R, self.n)
 
-        # fmt: off
-        alg_ans = [
-            (a["head"], a["winner"],
-             a["left"] if a["winner"] == a["right"] else a["right"])
-            for a in answers
-        ]
-        # fmt: on
+        alg_ans = _alg_answers(answers)
         self.search.push(alg_ans)
-        self.search.embedding = self.opt.embedding()
         self.opt.push(alg_ans)
         if self.meta["num_ans"] < (self.R * self.n) / 10:
             return self, True
@@ -222,9 +218,44 @@ class Adaptive(Sampler):
 
         valid_ans = self.opt.answers_[:n_ans]
         self.opt.fit(valid_ans)
+        self.search.set_embedding(self.opt.embedding(), version=self.opt.version_)
         self.meta["model_updates"] += 1
         return self, True
 
+    def get_delta(self, answers: List[Answer]) -> Dict[str, Any]:
+        """
+        Get the changes from ``process_answers(answers)``: the answers
+        themselves, the new embedding, the optimizer's state and some
+        metadata.
+
+        Other copies of this sampler apply these changes with
+        :meth:`apply_delta`, which avoids sending the posterior (an
+        ``n * n`` array) or the rest of the optimizer.
+        """
+        return {
+            "answers": answers,
+            "embedding": self.opt.embedding().copy(),
+            "version": self.opt.version_,
+            "opt_state": deepcopy(self.opt.optimizer_.state_dict()),
+            "meta": deepcopy(self.meta),
+            "opt_meta": deepcopy(self.opt.meta_),
+        }
+
+    def apply_delta(self, delta: Dict[str, Any]):
+        """
+        Update this sampler with changes from :meth:`get_delta`.
+        """
+        alg_ans = _alg_answers(delta["answers"])
+        if len(alg_ans):
+            self.search.push(alg_ans)
+            self.opt.push(alg_ans)
+        self.opt.set_embedding(delta["embedding"], version=delta["version"])
+        self.search.set_embedding(delta["embedding"], version=delta["version"])
+        if "opt_state" in delta:
+            self.opt.optimizer_.load_state_dict(delta["opt_state"])
+        self.opt.meta_.update(delta["opt_meta"])
+        self.meta = delta["meta"]
+
     def get_model(self) -> Dict[str, Any]:
         """
         Get the embedding alongside other related information.
@@ -412,19 +443,15 @@ class ARR(Adaptive):
         self.priority = priority
         super().__init__(R=R, module=module, **kwargs)
 
-    def get_queries(self, *args, **kwargs):
-        queries, scores, meta = super().get_queries(*args, **kwargs)
-
-        # (dataframe useful for manipulation below)
-        df = pd.DataFrame(queries, columns=["h", "l", "r"])
-        df["score"] = scores
-
+    def get_queries(self, num=None, stop=None, **kwargs):
         # Find the top scores per head
-        top_scores_by_head = df.groupby(by="h")["score"].nlargest(n=self.n_top)
-        top_idx = top_scores_by_head.index.droplevel(0)
+        queries, scores, n_searched = self.search.top_k(
+            self.n_top, per_head=True, stop=stop
+        )
 
-        top_queries = df.loc[top_idx]
-        top_scores = top_queries["score"].to_numpy()
+        # (dataframe useful for manipulation below)
+        top_queries = pd.DataFrame(queries, columns=["h", "l", "r"])
+        top_queries["score"] = scores
         top_queries = top_queries.sample(frac=1, replace=False)
 
         posted = top_queries[["h", "l", "r"]].to_numpy().astype("int64")
@@ -441,7 +468,7 @@ class ARR(Adaptive):
             msg = f"priority={self.priority} not in ['random', 'scores', 'approx']"
             raise ValueError(msg)
 
-        meta.update({"n_queries_scored_(complete)": len(df)})
+        meta = {"n_queries_scored_(complete)": n_searched}
         return posted, r_scores, meta
 
     def process_answers(self, *args, **kwargs):
@@ -480,15 +507,9 @@ class SRR(ARR):
         if q is not None:
             return q, score
 
-        head = int(np.random.choice(self.n))
-        _choices = list(set(range(self.n)) - {head})
-        choices = np.array(_choices)
-        bottoms = [
-            np.random.choice(choices, size=2, replace=False)
-            for _ in range(self.n_search)
-        ]
-
-        _queries = [[head, l, r] for l, r in bottoms]
+        head = np.random.randint(self.n)
+        bottoms = _random_pairs(self.n, self.n_search, exclude=head)
+        _queries = np.column_stack([np.full(self.n_search, head), bottoms])
         queries, scores = self.search.score(queries=_queries)
 
         top_idx = np.argmax(scores)
@@ -1,6 +1,6 @@
 import logging
 from time import sleep
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 
@@ -58,6 +58,14 @@ class Random(Sampler):
     def process_answers(self, ans: List[Answer]):
         return self, False
 
+    def passive_spec(self) -> Dict[str, Any]:
+        """
+        The spec to generate queries in the frontend with
+        :mod:`salmon.triplets.passive`.
+        """
+        targets = None if self.targets == list(range(self.n)) else self.targets
+        return {"class": "Random", "n": self.n, "targets": targets}
+
     def run(self, *args, **kwargs):
         from rejson import Path
         root = Path.rootPath()
@@ -1,11 +1,13 @@
 import logging
 import random
-from copy import deepcopy
-from typing import List, Tuple
+from collections import OrderedDict
+from time import time
+from typing import Any, Dict, List, Tuple
 
 import numpy as np
 
 from salmon.backend.sampler import Sampler
+from salmon.triplets.passive import round_robin_query
 from salmon.triplets.samplers.utils import Answer, Query
 
 logger = logging.getLogger(__name__)
@@ -20,6 +22,24 @@ def _get_query(n, head) -> Tuple[int, int, int]:
     return a, b, c
 
 
+def _random_pairs(n: int, size: int, exclude: int) -> np.ndarray:
+    """
+    Draw ``size`` pairs of distinct integers in ``range(n)``, none equal to
+    ``exclude``, uniformly at random. This takes ``O(size)`` time (not
+    ``O(n)``).
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(size, 2)
+    """
+    a = np.random.randint(n - 1, size=size)
+    b = np.random.randint(n - 2, size=size)
+    b += b >= a  # b != a
+    pairs = np.stack([a, b], axis=1)
+    pairs += pairs >= exclude  # skip over exclude
+    return pairs
+
+
 def _score_query(q: Tuple[int, int, int]) -> float:
     h, l, r = q
     score = max(abs(h - l), abs(h - r))
@@ -68,19 +88,22 @@ class _RoundRobin(Sampler):
 
         super().__init__(ident=ident)
 
-    def get_query(self, **kwargs) -> Tuple[Query, float]:
-        if self.order is None:
-            self.order = deepcopy(self.targets)
+    def __setstate__(self, state):
+        # order used to hold targets (not positions in targets)
+        if isinstance(state.get("order"), list):
+            state["order"] = None
+        self.__dict__.update(state)
 
-        idx = self.counter % len(self.order)
-        logger.warning("idx=%s", idx)
-        if idx == 0:
-            np.random.shuffle(self.order)
-
-        head = self.order[idx]
+    def get_query(self, **kwargs) -> Tuple[Query, float]:
+        m = len(self.targets)
+        idx = self.counter % m
+        logger.debug("idx=%s", idx)
+        if idx == 0 or self.order is None:
+            self.order = np.random.permutation(m)  # positions in targets
 
-        kids = set(self.targets) - {head}
-        a, b = np.random.choice(list(kids), size=2, replace=False)
+        pos = self.order[idx]
+        ((i, j),) = _random_pairs(m, 1, exclude=pos)
+        head, a, b = self.targets[pos], self.targets[i], self.targets[j]
         self.counter += 1
         score = max(abs(head - a), abs(head - b))
         return {"head": int(head), "left": int(a), "right": int(b)}, float(score)
@@ -102,18 +125,139 @@ class RoundRobin(_RoundRobin):
     Let the head of the triplet query rotate through the available items while choosing
     the bottom two items randomly. This class is user specific if the
     ``/query?puid=foo`` endpoint is hit.
+
+    Each participant only has a counter and the time they were last seen
+    stored; the order of the heads is a permutation seeded by the
+    participant (see :func:`salmon.triplets.passive.round_robin_query`).
+
+    Parameters
+    ----------
+    n : int
+        Number of objects
+    ident : str
+        Identifier of the algorithm
+    targets : Optional[List[int]]
+        The allowable indexes to ask about.
+    max_participants : int, optional (default=10_000)
+        The most participants to keep state for in memory. The least
+        recently seen participants are evicted first.
+    participant_ttl : float, optional (default=0)
+        Evict participants who haven't asked for a query in this many
+        seconds. Participants never expire if ``participant_ttl=0``.
+    persist : bool, optional (default=False)
+        Whether to store evicted participants in the database (in the hash
+        ``alg-{ident}-participants``), so they resume where they left off
+        instead of starting over.
+
+    Notes
+    -----
+    With ``sampling.passive_frontend`` (the default), the frontend
+    generates the queries and the counters are in the database instead
+    (the hash ``passive-{ident}-counters``). ``max_participants`` and
+    ``participant_ttl`` bound that hash in the same way, unless
+    ``persist=True`` (then no participant is evicted). The frontend's and
+    the backend's counters are separate, so changing
+    ``sampling.passive_frontend`` restarts every participant's cycle.
     """
-    def __init__(self, *args, **kwargs):
-        self.rr_args = args
-        self.rr_kwargs = kwargs
-        self.samplers = {}  # puid to roundrobing
+    def __init__(
+        self,
+        n,
+        d=2,
+        ident="",
+        targets=None,
+        max_participants=10_000,
+        participant_ttl=0,
+        persist=False,
+    ):
+        self.max_participants = max_participants
+        self.participant_ttl = participant_ttl
+        self.persist = persist
+        self.seed = random.randrange(2 ** 31)
+        self.participants = OrderedDict()  # puid to (counter, last seen)
+        self._db = None
 
-        super().__init__(*args, **kwargs)
+        super().__init__(n=n, d=d, ident=ident, targets=targets)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_db"] = None
+        return state
+
+    def __setstate__(self, state):
+        if "samplers" in state:  # saved before participants were compact
+            state.setdefault("seed", random.randrange(2 ** 31))
+            state.setdefault("max_participants", 10_000)
+            state.setdefault("participant_ttl", 0)
+            state.setdefault("persist", False)
+            state.setdefault("_db", None)
+            samplers = state.pop("samplers")
+            state.pop("rr_args", None)
+            state.pop("rr_kwargs", None)
+            state["participants"] = OrderedDict(
+                (puid, (s.counter, time())) for puid, s in samplers.items()
+            )
+        super().__setstate__(state)
 
     def get_query(self, puid: str = "") -> Tuple[Query, float]:
-        if puid not in self.samplers:
-            self.samplers[puid] = _RoundRobin(*self.rr_args, **self.rr_kwargs)
-        return self.samplers[puid].get_query()
+        counter = self._count(puid)
+        (h, a, b), score = round_robin_query(self.targets, self.seed, puid, counter)
+        return {"head": int(h), "left": int(a), "right": int(b)}, score
+
+    def _count(self, puid: str) -> int:
+        """
+        Get the number of queries participant ``puid`` has been asked (and
+        count the query about to be asked).
+        """
+        now = time()
+        if puid in self.participants:
+            counter, _ = self.participants.pop(puid)
+        else:
+            counter = self._restore(puid)
+        self.participants[puid] = (counter + 1, now)
+        self._evict(now)
+        return counter
+
+    def _evict(self, now: float):
+        evicted = {}
+        for puid, (counter, seen) in self.participants.items():
+            full = len(self.participants) - len(evicted) > self.max_participants
+            expired = self.participant_ttl and now - seen > self.participant_ttl
+            if not (full or expired):
+                break
+            evicted[puid] = counter
+        for puid in evicted:
+            self.participants.pop(puid)
+        if evicted and self.persist:
+            self._participants_db().hset(
+                f"alg-{self.ident}-participants", mapping=evicted
+            )
+
+    def _restore(self, puid: str) -> int:
+        if not self.persist:
+            return 0
+        counter = self._participants_db().hget(f"alg-{self.ident}-participants", puid)
+        return int(counter or 0)
+
+    def _participants_db(self):
+        if self._db is None:
+            self._db = self.redis_client()
+        return self._db
+
+    def passive_spec(self) -> Dict[str, Any]:
+        """
+        The spec to generate queries in the frontend with
+        :mod:`salmon.triplets.passive`.
+        """
+        targets = None if self.targets == list(range(self.n)) else self.targets
+        return {
+            "class": "RoundRobin",
+            "n": self.n,
+            "targets": targets,
+            "seed": self.seed,
+            "max_participants": self.max_participants,
+            "participant_ttl": self.participant_ttl,
+            "persist": self.persist,
+        }
 
     def process_answers(self, ans: List[Answer]):
         return self, True
@@ -74,3 +74,11 @@ class Validation(RoundRobin):
         if random.choice([True, False]):
             l, r = r, l
         return {"head": int(h), "left": int(l), "right": int(r)}, float(idx)
+
+    def passive_spec(self):
+        """
+        The spec to generate queries in the frontend with
+        :mod:`salmon.triplets.passive`.
+        """
+        queries = [[int(i) for i in q] for q in self._val_queries]
+        return {"class": "Validation", "n": self.n, "queries": queries}
@@ -33,6 +33,12 @@ class Embedding(BaseEstimator):
     """
     An optimization algorithm that produces an embedding from human responses
     of the form ``[head, winner, loser]``.
+
+    Attributes
+    ----------
+    version_ : int
+        The version of the embedding. This increases every time the embedding
+        changes (i.e., after every optimization step).
     """
 
     def __init__(
@@ -82,6 +88,7 @@ class Embedding(BaseEstimator):
         """
         self.meta_ = {"num_answers": 0, "model_updates": 0, "num_grad_comps": 0}
         self.initialized_ = True
+        self.version_ = 0
         self.answers_ = np.zeros((1000, 3), dtype="uint16")
 
         self.net_ = NeuralNet(
@@ -106,6 +113,7 @@ class Embedding(BaseEstimator):
             with torch.no_grad():
                 em = torch.from_numpy(embedding.astype("float32"))
                 self.net_.module_.embedding.data = em
+            self.version_ += 1
         return self
 
     # def converged(self):
@@ -209,6 +217,7 @@ class Embedding(BaseEstimator):
             with torch.no_grad():
                 self._project_onto_ball()
             self.optimizer_.zero_grad()
+            self.version_ += 1
 
             self.meta_["num_grad_comps"] += len(train_ans)
             self.meta_["model_updates"] += 1
@@ -261,6 +270,39 @@ class Embedding(BaseEstimator):
     def embedding(self) -> np.ndarray:
         return self.net_.module_._embedding.detach().numpy()
 
+    def __setstate__(self, state):
+        if state.get("initialized_", False):
+            state.setdefault("version_", 0)  # saved before versioning
+        super().__setstate__(state)
+
+    def set_embedding(self, embedding: np.ndarray, version: Optional[int] = None):
+        """
+        Set the embedding (e.g., from another copy of this optimizer).
+
+        Parameters
+        ----------
+        embedding : np.ndarray
+            The new embedding.
+        version : int, optional
+            The version of ``embedding``. If it's the same as ``version_``,
+            nothing is done.
+        """
+        if not (hasattr(self, "initialized_") and self.initialized_):
+            self.initialize()
+        if version is not None and version == self.version_:
+            return self
+        with torch.no_grad():
+            em = torch.from_numpy(np.array(embedding, dtype="float32"))
+            self.net_.module_._embedding.data = em
+        self.version_ = version if version is not None else self.version_ + 1
+        return self
+
+    def embedding_hash(self) -> str:
+        """
+        Get a hash of the current embedding's contents.
+        """
+        return gram_utils.embedding_hash(self.embedding())
+
     @property
     def embedding_(self) -> np.ndarray:
         return self.embedding()
@@ -1,12 +1,77 @@
+from contextlib import contextmanager
+
 import numpy as np
+import torch
 from sklearn.base import BaseEstimator
 
 import salmon.utils as utils
-from salmon.triplets.samplers.adaptive.search import gram_utils, score
+from salmon.triplets.samplers.adaptive.search import (
+    _search, gram_utils, score, score_numba, score_torch
+)
 
 logger = utils.get_logger(__name__)
 
 
+def _top_k(Q, scores, k, n, per_head=False):
+    """
+    Get the ``k`` highest scoring unique queries.
+
+    Parameters
+    ----------
+    Q : np.ndarray, shape=(q, 3)
+        Queries. Each row is ``[head, o1, o2]`` with ``o1 < o2``.
+    scores : np.ndarray, shape=(q, )
+        The score for each query.
+    k : int
+        The number of queries to keep.
+    n : int
+        The number of items.
+    per_head : bool, optional (default: ``False``)
+        If True, keep the top ``k`` queries for every head.
+
+    Returns
+    -------
+    Q, scores : np.ndarray, np.ndarray
+        The top queries and scores, sorted from high to low score.
+    """
+    valid = ~np.isnan(scores)
+    Q, scores = Q[valid], scores[valid]
+
+    keys = (Q[:, 0] * n + Q[:, 1]) * n + Q[:, 2]
+    _, idx = np.unique(keys, return_index=True)
+    Q, scores = Q[idx], scores[idx]
+
+    if per_head:
+        # sort by head, then by score (high to low) within each head
+        order = np.lexsort((-scores, Q[:, 0]))
+        heads = Q[order, 0]
+        starts = np.flatnonzero(np.r_[True, heads[1:] != heads[:-1]])
+        lengths = np.diff(np.r_[starts, len(heads)])
+        rank = np.arange(len(heads)) - np.repeat(starts, lengths)
+        idx = order[rank < k]
+    elif len(scores) > k:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return Q[idx], scores[idx]
+
+
+def _threshold(Q, scores, k, n, per_head=False):
+    """
+    Get the score a query has to beat to be in the top ``k`` queries (of its
+    head if ``per_head``), given the top queries ``Q`` and their ``scores``
+    from :func:`_top_k`.
+    """
+    if not per_head:
+        return scores[-1] if len(scores) >= k else -np.inf
+    threshold = np.full(n, np.inf)
+    np.minimum.at(threshold, Q[:, 0], scores)
+    threshold[np.bincount(Q[:, 0], minlength=n) < k] = -np.inf
+    return threshold
+
+
 class QueryScorer:
     """
     A class to score queries for adaptive searches.
@@ -22,6 +87,25 @@ class QueryScorer:
         where ``win2`` and ``lose2`` are the squared Euclidean distances
         between the winner and loser.
 
+    chunk_size : int, optional (default: ``1024``)
+        The number of answers to process at once when updating the
+        posterior. Peak memory when updating the posterior is about
+        ``16 * chunk_size * n`` bytes with ``n`` items.
+
+    tile_size : int, optional
+        The number of queries to score at once. By default, this is chosen
+        so each ``(tile_size, n)`` array is about 4MB.
+
+    backend : str, optional (default: ``"numpy"``)
+        The backend used to compute information gain. Choices are
+        ``"numpy"``, ``"torch"`` and ``"numba"``. The ``"numba"`` backend
+        falls back to ``"numpy"`` if Numba is not installed.
+
+    n_threads : int, optional
+        The number of threads the ``"torch"`` or ``"numba"`` backends use.
+        By default, the library default is used (which is 1 thread when
+        ``OMP_NUM_THREADS=1``, as in ``launch.sh``).
+
     Notes
     -----
     Inputs: include an embedding, noise model and history of answers
@@ -29,24 +113,111 @@ class QueryScorer:
 
     Outputs: query scores.
 
-    Internal state: the posterior, history.
+    Internal state: the (unnormalized) log posterior and the log-normalizer
+    of each row. Pushing answers only updates the rows of the heads that were
+    answered about.
+
+    The embedding has a content hash (``embedding_hash_``). Anything derived
+    from the embedding (the distance matrix and the result of ``top_k``) is
+    reused until the hash changes. The version of the embedding from its
+    source (``embedding_version_``) only lets ``set_embedding`` skip
+    hashing.
 
     Public API:
 
     * Update posterior.
+    * Update embedding (``set_embedding``).
     * Get scores.
 
     """
 
-    def __init__(self, embedding=None, probs=None):
+    def __init__(
+        self,
+        embedding=None,
+        probs=None,
+        chunk_size=1024,
+        tile_size=None,
+        backend="numpy",
+        n_threads=None,
+    ):
+        if backend not in ["numpy", "torch", "numba"]:
+            raise ValueError(f"backend={backend} not in ['numpy', 'torch', 'numba']")
         self.embedding = embedding
         self.probs = probs
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.backend = backend
+        self.n_threads = n_threads
+
+    def __setstate__(self, state):
+        if "embedding" in state:  # saved before the embedding was hashed
+            embedding = state.pop("embedding")
+            state.setdefault("chunk_size", 1024)
+            state.setdefault("tile_size", None)
+            state.setdefault("backend", "numpy")
+            state.setdefault("n_threads", None)
+            self.__dict__.update(state)
+            self.set_embedding(embedding)
+            if getattr(self, "initialized_", False):
+                n = len(self._tau_)
+                self._log_norm_ = np.full(n, np.log(n), dtype="float32")
+                self.posterior_version_ = 0
+                self._normalize(np.arange(n))
+            return
+        self.__dict__.update(state)
+
+    @property
+    def embedding(self):
+        return self._embedding
+
+    @embedding.setter
+    def embedding(self, embedding):
+        self.set_embedding(embedding)
+
+    def set_embedding(self, embedding, version=None) -> bool:
+        """
+        Set the embedding used to score queries.
+
+        Parameters
+        ----------
+        embedding : array-like, shape=(n, d)
+            The new embedding. It is copied.
+        version : int, optional
+            The version of the embedding from its source (e.g.,
+            ``Embedding.version_``). If it's the same as the version last
+            passed in, nothing is done (not even hashing the embedding).
+
+        Returns
+        -------
+        changed : bool
+            Whether the embedding changed. If not, any cached results are
+            kept.
+        """
+        if embedding is None:
+            self._embedding = None
+            return False
+        if version is not None and version == getattr(
+            self, "embedding_version_", None
+        ):
+            return False
+
+        X = np.array(embedding, copy=True)
+        h = gram_utils.embedding_hash(X)
+        self.embedding_version_ = version
+        if h == getattr(self, "embedding_hash_", None):
+            return False
+
+        self._embedding = X
+        self.embedding_hash_ = h
+        return True
 
     def _initialize(self):
         self.initialized_ = True
         n = len(self.embedding)
         self._tau_ = np.zeros((n, n), dtype="float32")
-        self.push([])
+        self._log_norm_ = np.full(n, np.log(n), dtype="float32")
+        self.posterior_ = np.full((n, n), 1 / n, dtype="float32")
+        self.posterior_version_ = 0
 
     def _random_queries(self, n, num=1000, trim=True):
         new_num = int(num * 1.1 + 3)
@@ -63,61 +234,225 @@ class QueryScorer:
         return queries
 
     def _distances(self):
-        G = gram_utils.gram_matrix(self.embedding)
-        return gram_utils.distances(G)
+        if not hasattr(self, "_distances_"):
+            self._distances_ = gram_utils.DistanceMatrix()
+        # set_embedding sets the hash last, so this embedding is at least as
+        # new as this hash
+        h = self.embedding_hash_
+        if getattr(self, "_distances_hash_", None) != h:
+            D = self._distances_.update(self.embedding)
+            self._distances_hash_ = h
+            return D
+        return self._distances_.D_
+
+    def _tile_size(self):
+        if self.tile_size:
+            return int(self.tile_size)
+        return max(2 ** 20 // len(self.embedding), 1)
+
+    def _score_fn(self):
+        if self.backend == "torch":
+            return score_torch
+        if self.backend == "numba":
+            if _search.numba is None:
+                logger.warning("Numba not installed; using backend='numpy'")
+                return score
+            return score_numba
+        return score
+
+    @contextmanager
+    def _threads(self):
+        """
+        Use ``n_threads`` threads in the torch or numba backends while
+        scoring. The thread count is process-wide (and used to train the
+        model too), so it's restored afterwards.
+        """
+        if not self.n_threads:
+            yield
+        elif self.backend == "torch":
+            old = torch.get_num_threads()
+            torch.set_num_threads(self.n_threads)
+            try:
+                yield
+            finally:
+                torch.set_num_threads(old)
+        elif self.backend == "numba" and _search.numba is not None:
+            numba = _search.numba
+            old = numba.get_num_threads()
+            numba.set_num_threads(min(self.n_threads, numba.config.NUMBA_NUM_THREADS))
+            try:
+                yield
+            finally:
+                numba.set_num_threads(old)
+        else:
+            yield
 
     def score(self):
         raise NotImplementedError
 
-    def _posterior(self, D, history):
+    def top_k(self, k, *, num=2_000_000, per_head=False, stop=None):
         """
-        Calculate the posterior.
+        Search random queries and keep the highest scoring ones.
+
+        Queries are generated and scored ``tile_size`` queries at a time, and
+        only the best ``k`` queries are kept between tiles. That means memory
+        does not grow with ``num``. Queries that don't beat the current
+        ``k``-th best score are dropped as soon as they're scored, and the
+        rest are merged with the best queries (removing duplicates) once
+        there are as many of them as best queries.
+
+        If neither the embedding nor the posterior changed since the last
+        complete search with the same arguments, that search is returned.
 
         Parameters
         ----------
-        D : array-like
-            Distance array. D[i, j] = ||x_i - x_j||_2^2
-        S : array-like, shape=(num_ans, 3)
-            History of answers.
+        k : int
+            The number of queries to keep.
+        num : int, optional (default: ``2_000_000``)
+            The number of random queries to search.
+        per_head : bool, optional (default: ``False``)
+            If True, keep the top ``k`` queries for every head.
+        stop : Event, optional
+            Stop searching when ``stop.is_set()``.
 
         Returns
         -------
-        posterior : array-like, shape=(self.n, self.n)
+        queries : np.ndarray, shape=(num_queries, 3)
+            The best queries. Each row is ``[head, o1, o2]`` with ``o1 < o2``.
+        scores : np.ndarray, shape=(num_queries, )
+            The scores of each query, from high to low.
+        n_searched : int
+            The number of queries searched (0 if the cached search was
+            returned).
+        """
+        if not hasattr(self, "initialized_"):
+            self._initialize()
+        key = (self.embedding_hash_, self.posterior_version_, k, num, per_head)
+        cached = getattr(self, "_top_k_", None)
+        if cached is not None and cached[0] == key:
+            _, best_Q, best_scores = cached
+            return best_Q.copy(), best_scores.copy(), 0
+
+        n = len(self.embedding)
+        tile_size = self._tile_size()
+        best_Q = np.empty((0, 3), dtype="int64")
+        best_scores = np.empty(0, dtype="float32")
+        threshold = np.full(n, -np.inf) if per_head else -np.inf
+        n_best = k * n if per_head else k  # the most queries kept
+        new_Q, new_scores, n_new = [], [], 0
+        n_searched = 0
+        while n_searched < num:
+            Q, scores = self.score(num=min(tile_size, num - n_searched))
+            n_searched += len(Q)
+
+            # (NaN scores are dropped too)
+            keep = scores > (threshold[Q[:, 0]] if per_head else threshold)
+            Q, scores = Q[keep], scores[keep]
+            O1, O2 = np.minimum(Q[:, 1], Q[:, 2]), np.maximum(Q[:, 1], Q[:, 2])
+            new_Q.append(np.stack((Q[:, 0], O1, O2), axis=1))
+            new_scores.append(scores)
+            n_new += len(Q)
+
+            stopped = stop is not None and stop.is_set()
+            if n_new >= max(n_best, tile_size) or n_searched >= num or stopped:
+                Q = np.concatenate([best_Q] + new_Q)
+                scores = np.concatenate([best_scores] + new_scores)
+                best_Q, best_scores = _top_k(Q, scores, k, n, per_head=per_head)
+                threshold = _threshold(best_Q, best_scores, k, n, per_head=per_head)
+                new_Q, new_scores, n_new = [], [], 0
+            if stopped:
+                break
+        if n_searched >= num:
+            self._top_k_ = (key, best_Q.copy(), best_scores.copy())
+        return best_Q, best_scores, n_searched
+
+    def _posterior(self, history):
         """
-        n = D.shape[0]
+        Add the answers in ``history`` to the posterior.
 
-        logger.info("history = %s", history)
-        if len(history):
-            for k, (head, w, l) in enumerate(history):
-                probs = self.probs(D[w], D[l])
-                probs[np.isnan(probs)] = 0
-                _eps = 1e-80
-                probs[probs <= _eps] = _eps
-                a = np.log(probs + _eps)
-                self._tau_[head] += a
+        Only the rows of the posterior with a head in ``history`` are
+        recomputed, so this takes ``O(len(history) * n)`` time instead of
+        ``O(n^2)`` (plus copying the posterior).
 
-        # idx = self._tau_ >= -np.inf
-        tau = np.zeros_like(self._tau_)
-        # tau[idx] = np.exp(self._tau_[idx])
-        tau = np.exp(self._tau_)
-        s = tau.sum(axis=1)  # the sum of each row
+        Parameters
+        ----------
+        history : array-like, shape=(num_ans, 3)
+            History of answers. Each row is ``[head, winner, loser]``.
 
-        gt0 = s > 0
-        eps = s[gt0].min() if gt0.any() else s.min()
+        Returns
+        -------
+        heads : np.ndarray
+            The (unique) rows of the posterior that were updated.
+        """
+        S = np.asarray(history, dtype="int64").reshape(-1, 3)
+        logger.info("len(history) = %s", len(S))
+        if not len(S):
+            return np.empty(0, dtype="int64")
+
+        # Sort by head so the answers for each head are contiguous and can be
+        # summed with np.add.reduceat (much faster than np.add.at)
+        S = S[np.argsort(S[:, 0], kind="stable")]
+        chunk_size = max(int(self.chunk_size), 1)
+        for k in range(0, len(S), chunk_size):
+            self._accumulate(S[k : k + chunk_size])
+
+        heads = np.unique(S[:, 0])
+        self._normalize(heads)
+        self.posterior_version_ += 1
+        return heads
+
+    def _accumulate(self, S):
+        """
+        Add the log-probabilities of the answers in ``S`` to ``_tau_``.
+        ``S`` must be sorted by head.
+        """
+        H, W, L = S[:, 0], S[:, 1], S[:, 2]
+        D = self._distances()
+        probs = self.probs(D[W], D[L])  # (chunk_size, n)
+        probs[np.isnan(probs)] = 0
+        _eps = 1e-80
+        probs[probs <= _eps] = _eps
+        a = np.log(probs + _eps)
 
-        s *= 1e4
-        tau *= 1e4
+        # segment-sum over each head
+        starts = np.flatnonzero(np.r_[True, H[1:] != H[:-1]])
+        self._tau_[H[starts]] += np.add.reduceat(a, starts, axis=0)
 
-        s = np.clip(s, eps, np.inf)
+    def _normalize(self, rows):
+        """
+        Normalize the posterior for the given rows.
 
-        tau2 = (tau.T / s).T  # transpose to make broadcasting work
-        return tau2
+        The log-normalizer of each row is cached in ``_log_norm_``, and it's
+        computed with the log-sum-exp trick. The rows are written to a copy
+        of the posterior that replaces ``posterior_``, so threads scoring
+        queries never see a partially updated posterior.
+        """
+        tau = self._tau_[rows]
+        m = tau.max(axis=1, keepdims=True)
+        m[~np.isfinite(m)] = 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_norm = m + np.log(np.exp(tau - m).sum(axis=1, keepdims=True))
+            post = np.exp(tau - log_norm)
+        post[np.isnan(post)] = 0  # rows without any mass
+
+        self._log_norm_[rows] = log_norm.flat
+        posterior = self.posterior_.copy()
+        posterior[rows] = post
+        self.posterior_ = posterior
 
     def push(self, history):
+        """
+        Update the posterior with new answers.
+
+        Parameters
+        ----------
+        history : array-like, shape=(num_ans, 3)
+            The answers received since the last call to ``push``. Each row
+            is ``[head, winner, loser]``.
+        """
         if not hasattr(self, "initialized_"):
             self._initialize()
-        D = self._distances()
-        self.posterior_ = self._posterior(D, history)
+        self._posterior(history)
         return self
 
 
@@ -137,14 +472,22 @@ class InfoGainScorer(QueryScorer):
         if not hasattr(self, "initialized_"):
             self._initialize()
         D = self._distances()
+        tau = self.posterior_.astype("float32", copy=False)
         if queries is not None and num != 1000:
             raise ValueError("Only specify one of `queries` or `num`")
         if queries is None:
             queries = self._random_queries(len(self.embedding), num=num)
         Q = np.array(queries).astype("int64")
-        H, O1, O2 = Q[:, 0], Q[:, 1], Q[:, 2]
 
-        scores = score(H, O1, O2, self.posterior_, D, probs=self.probs)
+        # Score in tiles so the (tile_size, n) temporaries in `score` stay
+        # small regardless of the number of queries
+        tile_size = self._tile_size()
+        _score = self._score_fn()
+        scores = np.empty(len(Q), dtype="float32")
+        with self._threads():
+            for k in range(0, len(Q), tile_size):
+                H, O1, O2 = Q[k : k + tile_size].T
+                scores[k : k + tile_size] = _score(H, O1, O2, tau, D, probs=self.probs)
         return Q, scores
 
 
@@ -1,2 +1,3 @@
-from salmon.triplets.samplers.adaptive.search._search import (decide,
-                                                              posterior, score)
+from salmon.triplets.samplers.adaptive.search._search import (
+    decide, posterior, score, score_numba, score_torch
+)
@@ -12,6 +12,11 @@ try:
 except:
     import gram_utils
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 Array = Union[np.ndarray, torch.Tensor]
 
 
@@ -282,3 +287,81 @@ def score(H: Array, W: Array, L: Array, tau: Array, D: Array, probs=STE_probs) -
 
     score = -p * entropy(taub) - (1 - p) * entropy(tauc)
     return score
+
+
+def score_torch(
+    H: Array, W: Array, L: Array, tau: Array, D: Array, probs=STE_probs
+) -> np.ndarray:
+    """
+    Find the information gain for each query with PyTorch.
+
+    This function has the same arguments and returns the same values as
+    :func:`score`. It uses PyTorch's (multi-threaded) operations, and
+    computes each entropy in one pass without normalizing the posterior:
+    for weights :math:`a` that sum to :math:`s`,
+    :math:`H(a / s) = \\log s - \\frac{1}{s}\\sum_i a_i \\log a_i`.
+    """
+    with torch.no_grad():
+        H, W, L = (torch.as_tensor(x) for x in (H, W, L))
+        tau, D = torch.as_tensor(tau), torch.as_tensor(D)
+        P = probs(D[L], D[W])  # (q, n)
+        P[torch.isnan(P)] = 0
+
+        tau_h = tau[H]  # (q, n)
+        a = tau_h * P
+        c = tau_h - a  # tau[head] * (1 - probs)
+        pa = a.sum(dim=1)
+        pc = c.sum(dim=1)
+        Ha = torch.log(pa) - torch.xlogy(a, a).sum(dim=1) / pa
+        Hc = torch.log(pc) - torch.xlogy(c, c).sum(dim=1) / pc
+        score = -pa * Ha - (1 - pa) * Hc
+    return score.numpy()
+
+
+if numba is not None:
+
+    # No "nnan" in fastmath: it'd let LLVM remove the NaN check below
+    @numba.njit(parallel=True, fastmath={"contract", "arcp"}, cache=True)
+    def _fused_score(H, tau, P):
+        q, n = P.shape
+        out = np.empty(q, dtype=np.float32)
+        for i in numba.prange(q):
+            row = tau[H[i]]
+            pa = 0.0
+            pc = 0.0
+            la = 0.0
+            lc = 0.0
+            for j in range(n):
+                p = P[i, j]
+                if p != p:  # NaN
+                    p = 0.0
+                a = row[j] * p
+                c = row[j] - a
+                pa += a
+                pc += c
+                if a > 0:
+                    la += a * np.log(a)
+                if c > 0:
+                    lc += c * np.log(c)
+            Ha = np.log(pa) - la / pa
+            Hc = np.log(pc) - lc / pc
+            out[i] = -pa * Ha - (1 - pa) * Hc
+        return out
+
+
+def score_numba(
+    H: Array, W: Array, L: Array, tau: Array, D: Array, probs=STE_probs
+) -> np.ndarray:
+    """
+    Find the information gain for each query with a Numba kernel.
+
+    This function has the same arguments and returns the same values as
+    :func:`score`. The posterior reweighting and both entropies are
+    computed in one parallel pass over the probabilities, so the only
+    ``(q, n)`` array is the output of ``probs``.
+    """
+    if numba is None:
+        raise ImportError("score_numba requires Numba. Install with `pip install numba`")
+    P = np.asarray(probs(D[L], D[W]), dtype="float32")
+    tau = np.asarray(tau, dtype="float32")
+    return _fused_score(np.asarray(H, dtype="int64"), tau, P)
@@ -1,3 +1,4 @@
+import hashlib
 from typing import Union
 
 import numpy as np
@@ -75,6 +76,131 @@ def distances(G: Array) -> Array:
     return D
 
 
+def distances_to(X: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """
+    Get the rows of the distance matrix without forming the full matrix.
+
+    Arguments
+    ---------
+    X : np.ndarray
+        Embedding. X.shape == (n, d)
+    idx : np.ndarray
+        Indices of the rows to compute. idx.shape == (k, )
+
+    Returns
+    -------
+    D : np.ndarray
+        Rows of the distance matrix. D.shape == (k, n) and
+        ``D[i, j] == ||X[idx[i]] - X[j]||_2^2``
+    """
+    norms = (X ** 2).sum(axis=1)
+    G = X[idx] @ X.T
+    return -2 * G + norms.reshape(1, -1) + norms[idx].reshape(-1, 1)
+
+
+def embedding_hash(X: Array) -> str:
+    """
+    Get a hash of the contents of an embedding.
+
+    Arguments
+    ---------
+    X : Array
+        Embedding. X.shape == (n, d)
+
+    Returns
+    -------
+    h : str
+        A hex digest that changes when any value in ``X`` changes.
+    """
+    if isinstance(X, torch.Tensor):
+        X = X.detach().numpy()
+    X = np.ascontiguousarray(X)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((X.shape, X.dtype.str)).encode())
+    h.update(X.tobytes())
+    return h.hexdigest()
+
+
+class DistanceMatrix:
+    """
+    A float32 distance matrix that is cached between calls.
+
+    The matrix is rebuilt when the embedding changes. If only a few rows of
+    the embedding move, only those rows and columns of the distance matrix
+    are recomputed. Either way, the new matrix is a new array that replaces
+    ``D_``, so other threads reading ``D_`` see the old or new distances
+    (never a partially updated matrix).
+
+    Parameters
+    ----------
+    max_frac : float, optional (default: ``0.25``)
+        Recompute the entire matrix if more than ``max_frac * n`` rows of
+        the embedding changed.
+
+    Attributes
+    ----------
+    D_ : np.ndarray
+        The distance matrix. D_.shape == (n, n)
+    """
+
+    def __init__(self, max_frac=0.25):
+        self.max_frac = max_frac
+        self._state = (None, None)  # (X_, D_), replaced together
+
+    @property
+    def X_(self):
+        return self._state[0]
+
+    @property
+    def D_(self):
+        return self._state[1]
+
+    def update(self, X: Array) -> np.ndarray:
+        """
+        Get the distance matrix for the embedding ``X``.
+
+        Arguments
+        ---------
+        X : Array
+            Embedding. X.shape == (n, d)
+
+        Returns
+        -------
+        D : np.ndarray
+            Distance matrix. D.shape == (n, n) and ``D.dtype == float32``
+        """
+        if isinstance(X, torch.Tensor):
+            X = X.detach().numpy()
+        X = np.asarray(X, dtype="float32")
+        X_old, D_old = self._state
+        if X_old is None or X_old.shape != X.shape:
+            return self._full(X)
+
+        changed = np.flatnonzero((X != X_old).any(axis=1))
+        if len(changed) > self.max_frac * len(X):
+            return self._full(X)
+        if not len(changed):
+            return D_old
+
+        rows = distances_to(X, changed)
+        D = D_old.copy()
+        D[changed] = rows
+        D[:, changed] = rows.T
+        self._state = (X.copy(), D)
+        return D
+
+    def _full(self, X):
+        norms = (X ** 2).sum(axis=1)
+
+        # -2 * G + G1 + G2 with only one (n, n) array
+        D = X @ X.T
+        D *= -2
+        D += norms.reshape(1, -1)
+        D += norms.reshape(-1, 1)
+        self._state = (X.copy(), D)
+        return D
+
+
 def dist2(G, a, b):
     # assert_gram(G)
     return G[a, a] + G[b, b] - 2 * G[a, b]
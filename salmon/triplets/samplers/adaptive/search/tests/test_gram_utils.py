@@ -114,3 +114,33 @@ def test_dist2(seed=None):
     gram_dists2 = [gram_utils.dist2(G, i[1], i[0]) for i in inds]
     assert np.allclose(dists, gram_dists1)
     assert np.allclose(dists, gram_dists2)
+
+
+def test_distance_matrix_updates(seed=None, n=20, d=3):
+    rng = check_random_state(seed)
+    X = rng.randn(n, d).astype("float32")
+    cache = gram_utils.DistanceMatrix()
+
+    def _expected(X):
+        D_star = scipy.spatial.distance.pdist(X.astype("float64")) ** 2
+        return scipy.spatial.distance.squareform(D_star)
+
+    D = cache.update(X)
+    assert D.dtype == np.float32
+    assert np.allclose(D, _expected(X), atol=1e-5)
+
+    # only a few rows move; the old array isn't modified (other threads
+    # could be reading it)
+    X_old = X.copy()
+    X[[2, 7]] += rng.randn(2, d).astype("float32")
+    D2 = cache.update(X)
+    assert D2 is not D and cache.D_ is D2
+    assert np.allclose(D2, _expected(X), atol=1e-5)
+    assert np.allclose(D, _expected(X_old), atol=1e-5)
+    assert cache.update(X) is D2
+
+    # every row moves
+    X = rng.randn(n, d).astype("float32")
+    D3 = cache.update(X)
+    assert D3 is not D2
+    assert np.allclose(D3, _expected(X), atol=1e-5)
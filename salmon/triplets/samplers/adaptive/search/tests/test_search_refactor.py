@@ -5,6 +5,7 @@ import pytest
 from sklearn.utils import check_random_state
 
 from salmon.triplets.samplers.adaptive import STE, TSTE, InfoGainScorer
+from salmon.triplets.samplers.adaptive._score import _top_k
 
 from .. import _search as search
 from .. import gram_utils
@@ -271,6 +272,187 @@ def test_salmon_posterior_refactor(n=30, d=2):
     assert pytest.approx(ratio.mean()) == 1
 
 
+def test_incremental_posterior(n=30, d=2):
+    rng = np.random.RandomState(42)
+    X = rng.randn(n, d).astype("float32")
+    est = TSTE(n)
+    history = [_simple_triplet(n, rng) for _ in range(600)]
+
+    search1 = InfoGainScorer(embedding=X, probs=est.probs)
+    search1.push(history)
+
+    search2 = InfoGainScorer(embedding=X, probs=est.probs)
+    for k in range(0, len(history), 50):
+        search2.push(history[k : k + 50])
+    assert np.allclose(search1.posterior_, search2.posterior_, atol=1e-6)
+
+    search3 = InfoGainScorer(embedding=X, probs=est.probs, chunk_size=7)
+    search3.push(history)
+    assert np.allclose(search1.posterior_, search3.posterior_, atol=1e-6)
+
+    D = gram_utils.distances(gram_utils.gram_matrix(X.astype("float64")))
+    tau = search.posterior(D, history)
+    assert np.allclose(search1.posterior_, tau, atol=1e-5)
+    assert np.allclose(search1.posterior_.sum(axis=1), 1)
+
+    log_norm = np.log(np.exp(search1._tau_.astype("float64")).sum(axis=1))
+    assert np.allclose(search1._log_norm_, log_norm, rtol=1e-4)
+
+    # threads still reading the old posterior don't see the new answers
+    P = search1.posterior_
+    P_old = P.copy()
+    search1.push(history[:5])
+    assert search1.posterior_ is not P and (P == P_old).all()
+
+
+@pytest.mark.parametrize("per_head", [False, True])
+def test_top_k(per_head, n=15, d=2, k=3):
+    rng = np.random.RandomState(42)
+    X = rng.randn(n, d).astype("float32")
+    est = TSTE(n)
+    history = [_simple_triplet(n, rng) for _ in range(200)]
+    search = InfoGainScorer(embedding=X, probs=est.probs, tile_size=100)
+    search.push(history)
+
+    Q, scores, n_searched = search.top_k(k, num=20_000, per_head=per_head)
+    assert n_searched == 20_000
+    assert (Q[:, 1] < Q[:, 2]).all()
+    assert len(np.unique(Q, axis=0)) == len(Q)
+    assert (np.diff(scores) <= 0).all()
+    _, scores2 = search.score(queries=Q)
+    assert np.allclose(scores, scores2)
+
+    if per_head:
+        heads, counts = np.unique(Q[:, 0], return_counts=True)
+        assert len(heads) == n and (counts == k).all()
+    else:
+        assert len(Q) == k
+        t = range(n)
+        all_queries = [(h, a, b) for h in t for a in t for b in t if h != a < b != h]
+        _, all_scores = search.score(queries=all_queries)
+        assert np.allclose(scores, np.sort(all_scores)[::-1][:k])
+
+
+@pytest.mark.parametrize("per_head", [False, True])
+def test_top_k_tiles(per_head, n=10, k=4):
+    # the tiled search agrees with keeping the top k of every query at once
+    rng = np.random.RandomState(42)
+    X = rng.randn(n, 2).astype("float32")
+    search = InfoGainScorer(embedding=X, probs=TSTE(n).probs, tile_size=50)
+    Q = rng.choice(n, size=(2000, 3))  # (with many duplicates)
+    O1, O2 = np.minimum(Q[:, 1], Q[:, 2]), np.maximum(Q[:, 1], Q[:, 2])
+    Q_sorted = np.stack((Q[:, 0], O1, O2), axis=1)
+    table = rng.randn(n ** 3).astype("float32")
+    table[::7] = np.nan
+    scores = table[(Q_sorted[:, 0] * n + O1) * n + O2]
+    tiles = iter(range(0, len(Q), 50))
+
+    def _score(num=1000):
+        i = next(tiles)
+        return Q[i : i + num], scores[i : i + num]
+
+    search.score = _score
+    Q1, s1, _ = search.top_k(k, num=len(Q), per_head=per_head)
+
+    Q2, s2 = _top_k(Q_sorted, scores, k, n, per_head=per_head)
+    assert np.allclose(s1, s2)
+    assert {tuple(q) for q in Q1} == {tuple(q) for q in Q2}
+
+
+@pytest.mark.parametrize("backend", ["torch", "numba"])
+def test_score_backends(backend, n=20, d=2):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    rng = np.random.RandomState(42)
+    X = rng.randn(n, d).astype("float32")
+    est = TSTE(n)
+    history = [_simple_triplet(n, rng) for _ in range(100)]
+    queries = [_simple_triplet(n, rng) for _ in range(500)]
+
+    expected = InfoGainScorer(embedding=X, probs=est.probs)
+    expected.push(history)
+    _, s1 = expected.score(queries=queries)
+
+    search = InfoGainScorer(embedding=X, probs=est.probs, backend=backend, tile_size=64)
+    search.push(history)
+    _, s2 = search.score(queries=queries)
+    assert np.allclose(s1, s2, atol=1e-5)
+
+
+@pytest.mark.parametrize("backend", ["torch", "numba"])
+def test_score_backends_nan_probs(backend, n=5):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    rng = np.random.RandomState(42)
+    tau = rng.uniform(size=(n, n)).astype("float32")
+    tau /= tau.sum(axis=1, keepdims=True)
+    D = rng.uniform(size=(n, n)).astype("float32")
+
+    def probs(d1, d2):
+        P = d1 * 0 + 0.5  # works for arrays and tensors
+        P[:, 0] = np.nan
+        return P
+
+    H, W, L = np.array([0, 1, 2]), np.array([1, 2, 3]), np.array([2, 3, 4])
+    expected = search.score(H, W, L, tau, D, probs=probs)
+    _score = {"torch": search.score_torch, "numba": search.score_numba}[backend]
+    scores = _score(H, W, L, tau, D, probs=probs)
+    assert np.isfinite(expected).all()
+    assert np.allclose(scores, expected, atol=1e-5)
+
+
+def test_score_threads():
+    torch = pytest.importorskip("torch")
+    X = np.random.RandomState(42).randn(10, 2).astype("float32")
+    est = TSTE(10)
+    old = torch.get_num_threads()
+    search = InfoGainScorer(embedding=X, probs=est.probs, backend="torch", n_threads=old + 1)
+    search.score(num=100)
+    assert torch.get_num_threads() == old
+
+
+def test_embedding_version(n=15, d=2):
+    rng = np.random.RandomState(42)
+    X = rng.randn(n, d).astype("float32")
+    est = TSTE(n)
+    search = InfoGainScorer(embedding=X, probs=est.probs, tile_size=100)
+    search.push([_simple_triplet(n, rng) for _ in range(50)])
+    h = search.embedding_hash_
+
+    # same contents: nothing is recomputed
+    assert not search.set_embedding(X.copy())
+    assert search.embedding_hash_ == h
+    Q1, s1, n_searched = search.top_k(3, num=1000)
+    assert n_searched == 1000
+    Q2, s2, n_searched = search.top_k(3, num=1000)
+    assert n_searched == 0
+    assert (Q1 == Q2).all() and np.allclose(s1, s2)
+
+    # new answers or a new embedding invalidate the cached search
+    search.push([_simple_triplet(n, rng)])
+    assert search._top_k_[0] != (h, search.posterior_version_, 3, 1000, False)
+
+    X2 = X.copy()
+    X2[0] += 1
+    assert search.set_embedding(X2, version=1)
+    assert search.embedding_hash_ != h
+    D = search._distances()
+    assert np.allclose(D[0], ((X2 - X2[0]) ** 2).sum(axis=1), atol=1e-5)
+
+    # the source's version only skips the same version of the embedding
+    assert not search.set_embedding(X2 + 1, version=1)
+    assert search.set_embedding(X, version=2)
+    assert np.allclose(search.embedding, X)
+    D = search._distances()
+    assert np.allclose(D[0], ((X - X[0]) ** 2).sum(axis=1), atol=1e-5)
+
+    # a version that matches an old counter isn't skipped
+    search = InfoGainScorer(embedding=X, probs=est.probs)
+    assert search.set_embedding(X2)
+    assert search.set_embedding(X, version=1)
+    assert np.allclose(search.embedding, X)
+
+
 def _score_next(q: [int, int, int], tau, X):
     """
     copy/pasted from STE/myApp.py's getQuery
@@ -301,3 +483,33 @@ def _score_next(q: [int, int, int], tau, X):
 
     entropy = -p * utilsSTE.getEntropy(taub) - (1 - p) * utilsSTE.getEntropy(tauc)
     return entropy
+
+
+def test_old_state(n=15, d=2):
+    rng = np.random.RandomState(42)
+    X = rng.randn(n, d).astype("float32")
+    est = TSTE(n)
+    history = [_simple_triplet(n, rng) for _ in range(50)]
+    new = InfoGainScorer(embedding=X, probs=est.probs)
+    new.push(history)
+
+    # the state of a scorer pickled before the embedding was hashed
+    state = {
+        "embedding": X,
+        "probs": est.probs,
+        "initialized_": True,
+        "_tau_": new._tau_.copy(),
+        "posterior_": new.posterior_.copy(),
+    }
+    old = InfoGainScorer.__new__(InfoGainScorer)
+    old.__setstate__(state)
+    assert old.embedding_hash_ == new.embedding_hash_
+    assert np.allclose(old.posterior_, new.posterior_, atol=1e-6)
+    assert np.allclose(old._log_norm_, new._log_norm_, rtol=1e-4)
+
+    more = [_simple_triplet(n, rng) for _ in range(10)]
+    old.push(more)
+    new.push(more)
+    assert np.allclose(old.posterior_, new.posterior_, atol=1e-6)
+    Q, scores, _ = old.top_k(3, num=1000)
+    assert len(Q) == 3 and np.isfinite(scores).all()
@@ -15,6 +15,8 @@ You may also consider getLoss to check how well an embedding is performing.
 
 from __future__ import print_function
 
+import math
+
 import numpy.random
 from numpy import *
 from numpy.linalg import *
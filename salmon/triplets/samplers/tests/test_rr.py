@@ -1,7 +1,10 @@
+from time import time
+
 import cloudpickle
 import numpy as np
+import pytest
 
-from salmon.triplets.samplers import RoundRobin
+from salmon.triplets.samplers import RoundRobin, _round_robin
 
 
 def test_rr():
@@ -13,3 +16,107 @@ def test_rr():
     assert alg2.n == 10
     assert alg.foo == alg2.foo
     assert alg.meta_ == alg2.meta_
+
+
+def test_rr_heads():
+    targets = [0, 2, 4, 6, 8, 9]
+    alg = RoundRobin(n=10, targets=targets)
+    for puid in ["a", "b"]:
+        heads = []
+        for _ in range(2 * len(targets)):
+            q, score = alg.get_query(puid=puid)
+            assert len({q["head"], q["left"], q["right"]}) == 3
+            assert {q["head"], q["left"], q["right"]}.issubset(targets)
+            heads.append(q["head"])
+        assert sorted(heads[:6]) == sorted(heads[6:]) == targets
+    assert alg.participants["a"][0] == alg.participants["b"][0] == 12
+
+
+def test_rr_eviction(monkeypatch):
+    alg = RoundRobin(n=10, max_participants=100)
+    for k in range(1000):
+        alg.get_query(puid=f"puid-{k}")
+    alg.get_query(puid="puid-900")
+    assert len(alg.participants) == 100
+    assert list(alg.participants)[-1] == "puid-900"
+    assert "puid-899" not in alg.participants
+
+    now = time()
+    monkeypatch.setattr(_round_robin, "time", lambda: now + 60)
+    alg.participant_ttl = 30
+    alg.get_query(puid="foo")
+    assert list(alg.participants) == ["foo"]
+
+
+def test_rr_persist(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    rj = fakeredis.FakeStrictRedis(decode_responses=True)
+    monkeypatch.setattr(RoundRobin, "redis_client", lambda self: rj)
+
+    alg = RoundRobin(n=10, ident="foo", max_participants=1, persist=True)
+    heads = [alg.get_query(puid="a")[0]["head"] for _ in range(3)]
+    alg.get_query(puid="b")
+    assert list(alg.participants) == ["b"]
+    assert rj.hget("alg-foo-participants", "a") == "3"
+
+    # "a" resumes where they left off (and the state is still small)
+    heads += [alg.get_query(puid="a")[0]["head"] for _ in range(7)]
+    assert sorted(heads) == list(range(10))
+    alg2 = cloudpickle.loads(cloudpickle.dumps(alg))
+    assert alg2.participants == alg.participants and alg2._db is None
+    assert len(cloudpickle.dumps(alg)) < 2000
+
+
+def test_rr_old_state():
+    alg = RoundRobin(n=10)
+    state = alg.__dict__.copy()
+    old = _round_robin._RoundRobin(n=10)
+    old.counter = 4
+    state.update(samplers={"a": old}, rr_args=(), rr_kwargs={"n": 10})
+    for k in ["participants", "seed", "max_participants", "persist", "_db"]:
+        state.pop(k)
+
+    alg2 = RoundRobin.__new__(RoundRobin)
+    alg2.__setstate__(state)
+    assert alg2.participants["a"][0] == 4
+    assert not hasattr(alg2, "samplers")
+    q, score = alg2.get_query(puid="a")
+    assert alg2.participants["a"][0] == 5
+
+
+def test_random_pairs():
+    np.random.seed(42)
+    pairs = _round_robin._random_pairs(5, 100_000, exclude=2)
+    assert pairs.shape == (100_000, 2)
+    assert (pairs[:, 0] != pairs[:, 1]).all() and (pairs != 2).all()
+    assert pairs.min() == 0 and pairs.max() == 4
+
+    # Every ordered pair is about equally likely
+    _, counts = np.unique(pairs, axis=0, return_counts=True)
+    assert len(counts) == 4 * 3
+    assert np.allclose(counts / len(pairs), 1 / 12, atol=0.005)
+
+
+def test_round_robin_private():
+    targets = [1, 3, 5, 7, 9]
+    alg = _round_robin._RoundRobin(n=10, targets=targets)
+    queries = [alg.get_query()[0] for _ in range(2 * len(targets))]
+    for q in queries:
+        assert len({q["head"], q["left"], q["right"]}) == 3
+        assert {q["head"], q["left"], q["right"]}.issubset(targets)
+    heads = [q["head"] for q in queries]
+    assert sorted(heads[:5]) == sorted(heads[5:]) == targets
+
+
+def test_round_robin_private_old_state():
+    targets = [5, 6, 7, 8, 9]
+    alg = _round_robin._RoundRobin(n=10, targets=targets)
+    alg.get_query()
+    state = alg.__dict__.copy()
+    state["order"] = [9, 7, 5, 8, 6]  # targets, not positions
+
+    alg2 = cloudpickle.loads(cloudpickle.dumps(alg))
+    alg2.__setstate__(state)
+    assert alg2.order is None
+    heads = [alg2.get_query()[0]["head"] for _ in range(4)]
+    assert set(heads).issubset(targets)
@@ -49,6 +49,9 @@ def test_defaults():
             "common": {"d": 2},
             "probs": {"random": 100},
             "samplers_per_user": 0,
+            "query_encoding": "str",
+            "query_timeout": 0.5,
+            "passive_frontend": True,
             "details": {},
         },
     }
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from salmon.triplets import manager
+
+
+def _answers(num=50, n=10, seed=42):
+    rng = np.random.RandomState(seed)
+    answers = []
+    for k in range(num):
+        h, l, r = rng.choice(n, size=3, replace=False).tolist()
+        w = [l, r][rng.randint(2)]
+        answers.append(
+            {
+                "head": h,
+                "left": l,
+                "right": r,
+                "winner": w,
+                "loser": l if w == r else r,
+                "puid": f"puid-{rng.randint(4)}",
+                "sampler": "foo",
+                "score": float(rng.uniform()),
+                "response_time": float(rng.uniform()),
+                "network_latency": float(rng.uniform()),
+                "time_received": 1600000000 + k + round(rng.uniform(), 3),
+            }
+        )
+    return answers
+
+
+def _targets(n=10):
+    return [f"<img src='/static/targets/{i}.png' />" for i in range(n)]
+
+
+def test_responses_table():
+    pa = pytest.importorskip("pyarrow")
+    answers, targets = _answers(), _targets()
+    expected = manager.get_responses(deepcopy(answers), targets, start_time=1600000000)
+    table = manager.responses_table(answers, targets, start_time=1600000000)
+
+    assert table.num_rows == len(answers)
+    for k in ["head", "left", "right", "winner", "loser"]:
+        assert table.schema.field(k).type == pa.int32()
+        assert pa.types.is_dictionary(table.schema.field(f"{k}_html").type)
+    assert pa.types.is_timestamp(table.schema.field("datetime_received").type)
+
+    df = table.to_pandas()
+    for k in ["head", "winner", "loser", "head_html", "winner_filename"]:
+        assert df[k].tolist() == [e[k] for e in expected]
+    for k in ["puid_num_responses", "num_responses", "time_received_since_start"]:
+        assert np.allclose(df[k], [e[k] for e in expected])
+    datetimes = [d.isoformat() for d in df["datetime_received"]]
+    assert datetimes == [e["datetime_received"] for e in expected]
+
+
+def _get_responses_loop(answers, targets, start_time=0):
+    # The implementation before get_responses was vectorized
+    user_responses = defaultdict(int)
+    for datum in answers:
+        puid = datum["puid"]
+        user_responses[puid] += 1
+        received = timedelta(seconds=datum["time_received"]) + datetime(1970, 1, 1)
+        keys = ["left", "right", "head", "winner", "loser"]
+        idxs = {k + "_html": targets[datum[k]] for k in keys}
+        names = {
+            k + "_filename": manager._get_filename(idxs[f"{k}_html"]) for k in keys
+        }
+        meta = {
+            "time_received_since_start": datum["time_received"] - start_time,
+            "datetime_received": received.isoformat(),
+            "start_time": start_time,
+            "puid_num_responses": user_responses[puid],
+            "num_responses": sum(user_responses.values()),
+        }
+        datum.update({**idxs, **names, **meta})
+    return answers
+
+
+@pytest.mark.parametrize("chunk_size", [None, 7])
+def test_get_responses_vectorized(chunk_size):
+    answers, targets = _answers(num=200), _targets()
+    answers[3]["time_received"] = 1600000000.0
+    answers[4]["time_received"] = 1600000000.5000005
+    answers[5]["puid"] = ""
+
+    expected = _get_responses_loop(deepcopy(answers), targets, start_time=1599999999)
+    if chunk_size is None:
+        out = manager.get_responses(answers, targets, start_time=1599999999)
+    else:
+        out = list(
+            manager.iter_responses(
+                answers, targets, start_time=1599999999, chunk_size=chunk_size
+            )
+        )
+    assert out == expected
+    assert [list(o) for o in out] == [list(e) for e in expected]
+    assert all(type(o[k]) == type(e[k]) for o, e in zip(out, expected) for k in e)
@@ -0,0 +1,109 @@
+from collections import Counter
+
+import pytest
+
+from salmon.triplets import passive
+from salmon.triplets.samplers import Random, RoundRobin, Validation
+
+
+def _redis(**specs):
+    fakeredis = pytest.importorskip("fakeredis")
+    rj = fakeredis.FakeStrictRedis(decode_responses=True)
+    for ident, spec in specs.items():
+        passive.store_spec(rj, ident, {"seed": 42, **spec})
+    return rj
+
+
+def test_not_passive():
+    rj = _redis(foo=Random(n=10).passive_spec())
+    assert passive.get_queries(rj, "bar") is None
+    assert not rj.exists("passive-bar-counters")
+
+
+def test_random():
+    targets = [1, 3, 5, 7]
+    rj = _redis(foo=Random(n=10, targets=targets).passive_spec())
+    queries = passive.get_queries(rj, "foo", n=100)
+    assert len(queries) == 100
+    for q in queries:
+        h, l, r = q["head"], q["left"], q["right"]
+        assert len({h, l, r}) == 3 and {h, l, r}.issubset(targets)
+        assert q["sampler"] == "foo" and q["score"] == -9999
+
+
+@pytest.mark.parametrize("targets", [None, [0, 2, 4, 6, 8, 9]])
+def test_round_robin(targets):
+    alg = RoundRobin(n=10, targets=targets)
+    targets = alg.targets
+    rj = _redis(foo=alg.passive_spec())
+
+    heads = {"a": [], "b": []}
+    for _ in range(3 * len(targets)):
+        for puid in heads:
+            (q,) = passive.get_queries(rj, "foo", puid=puid)
+            h, l, r = q["head"], q["left"], q["right"]
+            assert len({h, l, r}) == 3 and {h, l, r}.issubset(targets)
+            heads[puid].append(h)
+
+    # Every target is the head once per cycle, in a new order each cycle
+    m = len(targets)
+    for h in heads.values():
+        cycles = [h[k * m : (k + 1) * m] for k in range(3)]
+        assert all(sorted(c) == sorted(targets) for c in cycles)
+        assert cycles[0] != cycles[1] or cycles[1] != cycles[2]
+    assert heads["a"] != heads["b"]
+    assert rj.hgetall("passive-foo-counters") == {"a": str(3 * m), "b": str(3 * m)}
+
+    # Workers share the counter
+    more = passive.get_queries(rj, "foo", n=m, puid="a")
+    assert sorted(q["head"] for q in more) == sorted(targets)
+
+
+def test_validation():
+    queries = [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+    rj = _redis(foo=Validation(n=10, queries=queries).passive_spec())
+    out = passive.get_queries(rj, "foo", n=4 * len(queries), puid="a")
+    asked = [(q["head"], min(q["left"], q["right"])) for q in out]
+    for k in range(4):
+        cycle = asked[k * 3 : (k + 1) * 3]
+        assert sorted(cycle) == [(0, 1), (3, 4), (6, 7)]
+    assert Counter(q["score"] for q in out) == {0.0: 4, 1.0: 4, 2.0: 4}
+
+
+def test_validation_shared_counter():
+    queries = [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+    rj = _redis(foo=Validation(n=10, queries=queries).passive_spec())
+    a = passive.get_queries(rj, "foo", n=2, puid="a")
+    b = passive.get_queries(rj, "foo", n=2, puid="b")
+    assert [q["score"] for q in a + b] == [0.0, 1.0, 2.0, 0.0]
+
+    # "a" and "b" are asked about different queries in the first cycle
+    first = [(q["head"], min(q["left"], q["right"])) for q in a + b[:1]]
+    assert sorted(first) == [(0, 1), (3, 4), (6, 7)]
+    assert rj.hgetall("passive-foo-counters") == {"": "4"}
+
+
+def test_round_robin_eviction(monkeypatch):
+    rj = _redis(
+        foo=RoundRobin(n=10, max_participants=3, participant_ttl=60).passive_spec(),
+        bar=RoundRobin(n=10, max_participants=3, persist=True).passive_spec(),
+    )
+    now = 1e9
+    monkeypatch.setattr(passive, "time", lambda: now)
+    for puid in ["a", "b", "c", "d", "b"]:
+        for ident in ["foo", "bar"]:
+            passive.get_queries(rj, ident, puid=puid)
+            now += 1
+
+    # the least recently seen participant is evicted ...
+    assert rj.hgetall("passive-foo-counters") == {"b": "2", "c": "1", "d": "1"}
+    assert rj.zcard("passive-foo-seen") == 3
+    # ... unless the participants persist
+    assert len(rj.hgetall("passive-bar-counters")) == 4
+
+    # participants not seen in participant_ttl seconds are evicted
+    now += 100
+    passive.get_queries(rj, "foo", puid="e")
+    assert rj.hgetall("passive-foo-counters") == {"e": "1"}
+    (q,) = passive.get_queries(rj, "foo", puid="b")
+    assert rj.hget("passive-foo-counters", "b") == "1"
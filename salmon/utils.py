@@ -10,6 +10,13 @@ from pathlib import Path
 from queue import SimpleQueue as Queue
 from typing import List
 
+#: The Redis pub/sub channel for events between the frontend and samplers.
+#: The messages are ``"answers-{ident}"`` (new answers for sampler
+#: ``ident``), ``"reset"`` and ``"stopped-{ident}"`` (sampler ``ident``
+#: stopped after a reset).
+EVENT_CHANNEL = "salmon-events"
+
+
 def get_logger(name):
     # Config from https://docs.python-guide.org/writing/logging/ and
     # https://docs.python-guide.org/writing/logging/
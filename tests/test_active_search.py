@@ -1,6 +1,7 @@
 import itertools
 
 import numpy as np
+import pytest
 from sklearn.utils import check_random_state
 
 from salmon.triplets.samplers import TSTE
@@ -19,6 +20,15 @@ def dataset(n, num_ans=1000, random_state=42):
     return X, y
 
 
+def answer_dicts(n, num_ans=200, random_state=42):
+    """Get answers from ``dataset`` formatted like the frontend sends them."""
+    X, y = dataset(n, num_ans=num_ans, random_state=random_state)
+    return [
+        {"head": h, "left": l, "right": r, "winner": l if yi == 0 else r}
+        for (h, l, r), yi in zip(X.tolist(), y)
+    ]
+
+
 def answer(X, y):
     answers = [
         {"head": h, "left": l, "right": r, "winner": l if yi == 0 else r}
@@ -93,3 +103,131 @@ def test_same_salmon_next(n=40, d=2, num_ans=4000):
     assert -0.93 < p(scores[useless], 70) < p(scores[useful], 26) < -0.90
     assert -0.80 < p(scores[useless], 85) < p(scores[useful], 30) < -0.77
     assert -0.76 < p(scores[useless], 90) < p(scores[useful], 80) < -0.74
+
+
+def test_delta_keeps_replicas_in_sync(n=30, d=2):
+    from copy import deepcopy
+
+    answers = answer_dicts(n)
+    alg = TSTE(n=n, d=d, R=1, random_state=42)
+    replica = deepcopy(alg)
+    for k in range(0, len(answers), 50):
+        _, update = alg.process_answers(answers[k : k + 50])
+        replica.apply_delta(alg.get_delta(answers[k : k + 50]))
+
+    assert alg.meta["model_updates"] > 0
+    assert replica.meta == alg.meta
+    assert replica.opt.version_ == alg.opt.version_
+    assert np.allclose(replica.opt.embedding(), alg.opt.embedding())
+    assert replica.search.embedding_hash_ == alg.search.embedding_hash_
+    _assert_same_optimizer(replica.opt, alg.opt)
+    assert np.allclose(replica.search.embedding, alg.search.embedding)
+    assert np.allclose(replica.search.posterior_, alg.search.posterior_)
+    n_ans = alg.opt.meta_["num_answers"]
+    assert (replica.opt.answers_[:n_ans] == alg.opt.answers_[:n_ans]).all()
+
+
+def _assert_same_optimizer(opt1, opt2):
+    import torch
+
+    s1, s2 = opt1.optimizer_.state_dict(), opt2.optimizer_.state_dict()
+    assert s1["param_groups"] == s2["param_groups"]
+    assert s1["state"].keys() == s2["state"].keys() and len(s1["state"])
+    for k, v in s1["state"].items():
+        for name, x in v.items():
+            assert torch.allclose(torch.as_tensor(x), torch.as_tensor(s2["state"][k][name]))
+
+
+def test_search_error_keeps_delta(n=30, d=2):
+    from concurrent.futures import Future
+
+    from salmon.backend.sampler import _gather, _LocalExecution
+
+    alg = TSTE(n=n, d=d, R=1, random_state=42)
+    ex = _LocalExecution(alg, None)
+    ex.start()
+    answers = answer_dicts(n)
+    f_model = ex.process_answers(answers, None)
+    f_post, f_search = Future(), Future()
+    f_post.set_result(0)
+    f_search.set_exception(ValueError("search failed"))
+    with pytest.raises(ValueError, match="search failed"):
+        _gather(alg, f_post, f_model, f_search)
+
+    # the model's changes (including the optimizer) are on this object...
+    model = ex.model
+    n_ans = model.opt.meta_["num_answers"]
+    assert n_ans == alg.opt.meta_["num_answers"] > 0
+    assert alg.meta == model.meta
+    assert np.allclose(alg.opt.embedding(), model.opt.embedding())
+    _assert_same_optimizer(alg.opt, model.opt)
+
+    # ... so the restarted replicas have them too
+    ex.stop()
+    assert ex.start()
+    assert (ex.search.opt.answers_[:n_ans] == model.opt.answers_[:n_ans]).all()
+    assert np.allclose(ex.search.search.posterior_, model.search.posterior_)
+
+
+def test_sampler_actor(n=30, d=2):
+    from salmon.backend.sampler import SamplerActor
+
+    with pytest.raises(ValueError, match="execution"):
+        TSTE(n=n, d=d, execution="foo")
+
+    alg = TSTE(n=n, d=d, R=1, random_state=42, execution="actors")
+    model, search = SamplerActor(alg), SamplerActor(TSTE(n=n, d=d, random_state=42))
+    answers = answer_dicts(n)
+    update, delta = model.process_answers(answers)
+    queries, scores, meta = search.get_queries(delta, num=10)
+    assert update
+    assert len(queries) == len(scores) == 10
+    assert np.allclose(search.sampler.search.embedding, alg.search.embedding)
+
+
+def test_actor_execution(n=30, d=2):
+    from salmon.backend.sampler import _ActorExecution
+
+    distributed = pytest.importorskip("distributed")
+    with distributed.LocalCluster(
+        n_workers=3, processes=False, dashboard_address=None
+    ) as cluster, distributed.Client(cluster) as client:
+        alg = TSTE(n=n, d=d, R=1, random_state=42, execution="actors")
+        ex = _ActorExecution(alg, client)
+        assert ex.start() and not ex.start()
+        assert ex.model_worker != ex.search_worker
+
+        answers = answer_dicts(n)
+        done = ex.event()
+        done.clear()
+        update, delta = ex.process_answers(answers, done).result()
+        assert update and done.is_set()
+        queries, scores, meta = ex.get_queries(delta, done).result()
+        assert len(queries) == len(scores) > 0
+
+        alg.apply_delta(delta)
+        ex.stop()
+        assert ex.start()
+        ex.close()
+        assert ex.model is None and ex._pool._shutdown
+
+
+def test_auto_execution(n=30, d=2):
+    from salmon.backend import sampler
+
+    class FakeClient:
+        def __init__(self, n_workers):
+            self.workers = {f"tcp://127.0.0.1:{k}": [] for k in range(n_workers)}
+
+        def has_what(self):
+            return self.workers
+
+    alg = TSTE(n=n, d=d)
+    assert alg.execution == "auto"
+    ex = sampler._auto_execution(alg, FakeClient(1))
+    assert isinstance(ex, sampler._LocalExecution)
+    assert ex.start() and not ex.start()
+    assert ex.model is not alg and ex.search is not ex.model
+    f = ex.get_queries(None, ex.event())
+    queries, scores, _ = f.result()
+    assert len(queries) == len(scores)
@@ -4,6 +4,7 @@ import os
 import pickle
 import random
 from datetime import datetime, timedelta
+from io import StringIO
 from pathlib import Path
 from time import sleep, time
 from typing import Tuple
@@ -151,6 +152,40 @@ def test_no_repeats(server):
     assert not equal_targets.all()
 
 
+def test_queries_batch(server):
+    server.authorize()
+    exp = Path(__file__).parent / "data" / "exp.yaml"
+    server.post("/init_exp", data={"exp": exp.read_text()})
+    for n in [1, 5]:
+        queries = server.get(f"/queries?n={n}").json()
+        assert len(queries) == n
+        assert len({q["sampler"] for q in queries}) == 1
+        for q in queries:
+            assert {"head", "left", "right", "score", "sampler"} <= set(q)
+            ans = {"winner": random.choice([q["left"], q["right"]]), "puid": "foo", **q}
+            server.post("/answer", data=ans)
+
+    r = server.get("/responses")
+    assert len(r.json()) == 6
+
+
+def test_responses_csv(server):
+    server.authorize()
+    exp = Path(__file__).parent / "data" / "exp.yaml"
+    server.post("/init_exp", data={"exp": exp.read_text()})
+    for k in range(20):
+        q = server.get("/query").json()
+        ans = {"winner": random.choice([q["left"], q["right"]]), "puid": "foo", **q}
+        server.post("/answer", data=ans)
+
+    r = server.get("/responses?json=0")
+    df = pd.read_csv(StringIO(r.text))
+    json_df = pd.DataFrame(server.get("/responses").json())
+    assert len(df) == len(json_df) == 20
+    assert list(df.columns) == list(json_df.columns)
+    assert (df["winner"] == json_df["winner"]).all()
+
+
 def test_meta(server):
     server.authorize()
     exp = Path(__file__).parent / "data" / "exp.yaml"
@@ -394,3 +429,74 @@ def test_defaults_acceptable_config(server):
     assert r.status_code == 200
     config2 = server.get("/config").json()
     assert config == config2
+
+
+def test_stream_csv_columns():
+    from salmon.frontend.private import _stream_csv
+
+    rows = [{"head": 0, "winner": 1}, {"head": 2, "winner": 3, "legacy": "x"}]
+    keys = ["head", "winner", "legacy"]
+    out = "".join(_stream_csv(iter(rows), keys=keys, chunk_size=1))
+    df = pd.read_csv(StringIO(out))
+    assert list(df.columns) == ["head", "winner", "legacy"]
+    assert df["legacy"].fillna("").tolist() == ["", "x"]
+
+
+def test_bad_export_format():
+    from fastapi import HTTPException
+
+    from salmon.frontend.private import _check_format
+
+    _check_format(None)
+    _check_format("parquet")
+    with pytest.raises(HTTPException) as e:
+        _check_format("xlsx")
+    assert e.value.status_code == 400
+    assert "'parquet', 'arrow'" in e.value.detail
+
+
+def test_queries_sampler_per_query(monkeypatch):
+    import asyncio
+
+    from salmon.frontend import public
+
+    async def _sampler_queries(sampler, n, puid=""):
+        return [{"sampler": sampler, "head": k} for k in range(n)]
+
+    monkeypatch.setattr(public, "_get_samplers", lambda: (["a", "b"], [0.5, 0.5]))
+    monkeypatch.setattr(public, "_sampler_queries", _sampler_queries)
+    queries = asyncio.run(public.get_queries(n=100))
+    assert len(queries) == 100
+    assert {q["sampler"] for q in queries} == {"a", "b"}
+    for s in ["a", "b"]:
+        heads = [q["head"] for q in queries if q["sampler"] == s]
+        assert heads == list(range(len(heads)))
+
+    queries = asyncio.run(public.get_queries(sampler="b", n=4))
+    assert [q["sampler"] for q in queries] == ["b"] * 4
+
+
+def test_queries_budget_per_query(monkeypatch):
+    import asyncio
+
+    from salmon.frontend import public
+
+    calls = {}
+
+    async def _backend_queries(endpoint, sampler, timeout):
+        calls["timeout"] = timeout
+        return [{"sampler": sampler, "score": 1.0, "head": 0}]
+
+    async def _pop_queries(sampler, n, encoding="str"):
+        return [{"sampler": sampler, "score": -9999, "head": 1}] * n
+
+    async def _get_sampling():
+        return {"query_timeout": 0.5}
+
+    monkeypatch.setattr(public.passive, "get_queries", lambda *a, **kw: None)
+    monkeypatch.setattr(public, "_get_sampling", _get_sampling)
+    monkeypatch.setattr(public, "_backend_queries", _backend_queries)
+    monkeypatch.setattr(public, "_pop_queries", _pop_queries)
+    queries = asyncio.run(public.get_queries(sampler="a", n=4))
+    assert calls["timeout"] == 2.0
+    assert [q["score"] for q in queries] == [1.0, -9999, -9999, -9999]